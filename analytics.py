@@ -0,0 +1,86 @@
+# =========================================================
+# 利用状況の分析（理事会向けの稼働率・取消率）
+# - 入力は保存先の集計表（usage_totals）。予約・取消のたびに更新済みなので、
+#   ここでは予約の全行を読まず、小さな集計表を pandas でまとめ直すだけ
+# - 合わせて使う区画（全面など）の使用分数は、それを構成する部屋それぞれに数える
+# - 稼働率 = 使用分数 ÷ 開室時間（SLOT_ORIGIN〜最終枠の終わり）× 日数
+# Streamlit には依存しない
+# =========================================================
+
+import pandas as pd
+
+from model import SLOT_ENDS, SLOT_ORIGIN, fmt_minutes
+from storage import USAGE_SLOT
+
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+OPEN_MINUTES = SLOT_ENDS[-1] - SLOT_ORIGIN
+
+
+def usage_frames(totals, layout):
+    """usage_totals() の結果 → (部屋ごとの使用分数, 区画ごとの予約・取消件数) の DataFrame
+
+    使用分数は layout の部屋（part）に展開し、開室時間外の枠と layout にない区画は除く。
+    """
+    minutes, bookings = totals
+    minutes = pd.DataFrame(minutes, columns=["month", "weekday", "slot", "room", "minutes"])
+    bookings = pd.DataFrame(bookings, columns=["month", "room", "booked", "cancelled"])
+    parts = pd.DataFrame([(room, part) for room in layout.rooms for part in layout.parts[room]],
+                         columns=["room", "part"])
+    minutes = minutes.merge(parts, on="room")
+    open_slot = ((minutes["slot"] * USAGE_SLOT >= SLOT_ORIGIN)
+                 & (minutes["slot"] * USAGE_SLOT < SLOT_ENDS[-1]))
+    minutes = minutes[open_slot]
+    bookings = bookings[bookings["room"].isin(layout.rooms)]
+    return minutes, bookings
+
+
+def months_of(minutes, bookings):
+    """集計に現れる月（"YYYY-MM"）の昇順リスト"""
+    return sorted(set(minutes["month"]) | set(bookings["month"]))
+
+
+def calendar_days(first_month, last_month):
+    """first_month〜last_month の各日の (月, 曜日) ごとの日数"""
+    days = pd.date_range(f"{first_month}-01", pd.Period(last_month, "M").end_time.normalize(), freq="D")
+    frame = pd.DataFrame({"month": days.strftime("%Y-%m"), "weekday": days.weekday})
+    return frame.groupby(["month", "weekday"]).size().rename("days").reset_index()
+
+
+def _rates(used, days, per_day, parts):
+    """部屋ごとの使用分数（行）÷ 延べ開室分数 → 部屋の列と「全体」の列を持つ稼働率（%）"""
+    table = used.pivot_table(index=used.columns[0], columns="part", values="minutes", aggfunc="sum", fill_value=0)
+    table = table.reindex(columns=parts, fill_value=0).reindex(days.index, fill_value=0)
+    capacity = days * per_day
+    rates = table.div(capacity, axis=0)
+    rates["全体"] = table.sum(axis=1) / (capacity * len(parts))
+    return (rates * 100).round(1)
+
+
+def occupancy_report(minutes, bookings, layout, first_month, last_month):
+    """first_month〜last_month の稼働率（月別・曜日別・時間枠別）と取消率（月別）
+
+    戻り値は {"month": ..., "weekday": ..., "slot": ..., "cancel": ...} の DataFrame。
+    稼働率は部屋ごとの列と「全体」（全部屋の平均）の列を持つ（%）。
+    """
+    parts = [p for _, group_parts, _ in layout.groups for p in group_parts]
+    in_range = minutes[(minutes["month"] >= first_month) & (minutes["month"] <= last_month)]
+    days = calendar_days(first_month, last_month)
+
+    by_month = _rates(in_range[["month", "part", "minutes"]], days.groupby("month")["days"].sum(),
+                      OPEN_MINUTES, parts)
+
+    weekday_days = days.groupby("weekday")["days"].sum()
+    by_weekday = _rates(in_range[["weekday", "part", "minutes"]], weekday_days, OPEN_MINUTES, parts)
+    by_weekday.index = [WEEKDAYS[i] for i in by_weekday.index]
+
+    slots = pd.Index(range(SLOT_ORIGIN // USAGE_SLOT, SLOT_ENDS[-1] // USAGE_SLOT), name="slot")
+    slot_days = pd.Series(weekday_days.sum(), index=slots)
+    by_slot = _rates(in_range[["slot", "part", "minutes"]], slot_days, USAGE_SLOT, parts)
+    by_slot.index = [fmt_minutes(s * USAGE_SLOT) for s in by_slot.index]
+
+    booked = bookings[(bookings["month"] >= first_month) & (bookings["month"] <= last_month)]
+    cancel = booked.groupby("month")[["booked", "cancelled"]].sum()
+    cancel["取消率"] = (cancel["cancelled"] / cancel["booked"].where(cancel["booked"] > 0) * 100).round(1)
+    cancel = cancel.rename(columns={"booked": "予約件数", "cancelled": "取消件数"})
+
+    return {"month": by_month, "weekday": by_weekday, "slot": by_slot, "cancel": cancel}
@@ -0,0 +1,165 @@
+# =========================================================
+# 空き状況の JSON API（読み取り専用、サイネージ・他ツール向け）
+#   GET /availability?date=2025-10-17          … その日
+#   GET /availability?date=2025-10-17&days=7   … その日から7日分（最大 MAX_DAYS）
+#   GET /availability?date=2025-10-17&week=1   … その日を含む週（月〜日）
+# - 予約はアプリと同じ共有スナップショットから返す（source が返すもの）。
+#   Google Sheets は読まず、読込範囲外の日も主ストア（SQLite）から読み足すだけ
+# - 本文のハッシュを ETag とし、If-None-Match が一致すれば 304 を返す
+# - 標準ライブラリの http.server だけで動く。Streamlit には依存しない
+# =========================================================
+
+import hashlib
+import json
+import logging
+import threading
+from datetime import date as _date, timedelta
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from model import SLOT_MINUTES, TIME_SLOTS, fmt_minutes
+
+log = logging.getLogger(__name__)
+
+MAX_DAYS = 31
+MAX_DISTANCE_DAYS = 366   # 今日からこの日数より離れた日は受け付けない（読込範囲を広げすぎない）
+
+
+def availability(snapshot, layout, first, days):
+    """first（date）から days 日分の空き状況（JSON にする dict）
+
+    rooms は区画ごとの枠の使用中フラグ（TIME_SLOTS と同じ並び。全面は前側・奥側のどちらかが使用中なら1）、
+    bookings はその日の有効な予約（担当者などは含めない）。
+    """
+    out = []
+    for i in range(days):
+        d = first + timedelta(days=i)
+        day = d.toordinal()
+        rooms = {}
+        for room in layout.rooms:
+            mask = snapshot.occupancy_mask(day, layout.masks[room])
+            rooms[room] = [mask >> j & 1 for j in range(len(TIME_SLOTS))]
+        bookings = [
+            {"room": r.room, "start": fmt_minutes(r.start), "end": fmt_minutes(r.end)}
+            for r in sorted(snapshot.on_date(day), key=lambda r: (r.start, r.room)) if r.status == "active"
+        ]
+        out.append({"date": d.isoformat(), "rooms": rooms, "bookings": bookings})
+    return {"slot_minutes": SLOT_MINUTES, "slots": TIME_SLOTS, "days": out}
+
+
+def parse_query(query, today):
+    """クエリ文字列 → (最初の日, 日数)。不正な値は ValueError"""
+    params = parse_qs(query)
+    first = _date.fromisoformat(params["date"][0]) if "date" in params else today
+    days = int(params.get("days", ["1"])[0])
+    if params.get("week", ["0"])[0] not in ("", "0"):
+        first, days = first - timedelta(days=first.weekday()), 7
+    if not 1 <= days <= MAX_DAYS:
+        raise ValueError(f"days は 1〜{MAX_DAYS} で指定してください")
+    if abs((first - today).days) > MAX_DISTANCE_DAYS:
+        raise ValueError(f"date は今日の前後 {MAX_DISTANCE_DAYS} 日以内で指定してください")
+    return first, days
+
+
+def etag_matches(header, etag):
+    """If-None-Match（カンマ区切り、W/ 付き・* も可）が etag に一致するか"""
+    if not header:
+        return False
+    tags = [t.strip() for t in header.split(",")]
+    return "*" in tags or etag in (t[2:] if t.startswith("W/") else t for t in tags)
+
+
+class AvailabilityServer(ThreadingHTTPServer):
+    """空き状況 API のサーバー。
+
+    source(lo, hi) は序数 [lo, hi) を読込済みのスナップショットを返す関数（SnapshotStore.ensure）。
+    応答本文はスナップショットの version と問い合わせごとに CACHE_SIZE 件まで使い回す。
+    thread_setup は各リクエストのスレッドの最初に呼ぶ関数（呼び出し元の実行環境の引き継ぎ用）。
+    """
+    daemon_threads = True
+    CACHE_SIZE = 256
+
+    def __init__(self, address, source, layout, metrics=None, thread_setup=None, today=_date.today):
+        super().__init__(address, AvailabilityHandler)
+        self.source = source
+        self.layout = layout
+        self.metrics = metrics
+        self.thread_setup = thread_setup
+        self.today = today
+        self._cache = {}
+        self._lock = threading.Lock()
+
+    def response(self, first, days):
+        """(ETag, 本文) を返す。同じスナップショット・同じ問い合わせなら作り直さない"""
+        lo = first.toordinal()
+        snapshot = self.source(lo, lo + days)
+        key = (snapshot.version, lo, days)
+        with self._lock:
+            hit = self._cache.get(key)
+        if hit:
+            return hit
+        data = availability(snapshot, self.layout, first, days)
+        body = json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+        etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        with self._lock:
+            if len(self._cache) >= self.CACHE_SIZE:
+                self._cache.clear()
+            self._cache[key] = (etag, body)
+        return etag, body
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, name="availability-api", daemon=True).start()
+        log.info("空き状況 API を開始しました: http://%s:%d/availability", *self.server_address[:2])
+        return self
+
+
+class AvailabilityHandler(BaseHTTPRequestHandler):
+    server_version = "meeting-room-availability/1"
+
+    def do_HEAD(self):
+        self.do_GET(head=True)
+
+    def do_GET(self, head=False):
+        server = self.server
+        if server.thread_setup:
+            server.thread_setup()
+        url = urlsplit(self.path)
+        if url.path.rstrip("/") != "/availability":
+            return self._send(404, b'{"error":"not found"}', head=head)
+        try:
+            first, days = parse_query(url.query, server.today())
+        except (KeyError, ValueError) as e:
+            body = json.dumps({"error": str(e)}, ensure_ascii=False).encode("utf-8")
+            return self._send(400, body, head=head)
+        try:
+            if server.metrics:
+                server.metrics.count("api.requests")
+                with server.metrics.span("api"):
+                    etag, body = server.response(first, days)
+            else:
+                etag, body = server.response(first, days)
+        except Exception:
+            log.exception("空き状況 API の応答を作れませんでした")
+            return self._send(503, b'{"error":"unavailable"}', head=head)
+        if etag_matches(self.headers.get("If-None-Match"), etag):
+            if server.metrics:
+                server.metrics.count("api.not_modified")
+            return self._send(304, b"", etag=etag, head=True)
+        self._send(200, body, etag=etag, head=head)
+
+    def _send(self, code, body, etag=None, head=False):
+        self.send_response(code)
+        if code != 304:
+            self.send_header("Content-Type", "application/json; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+        if etag:
+            self.send_header("ETag", etag)
+        # 毎回 If-None-Match で確かめてもらう（変化がなければ 304 で本文なし）
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Access-Control-Allow-Origin", "*")
+        self.end_headers()
+        if not head:
+            self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug("%s - %s", self.address_string(), fmt % args)
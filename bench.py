@@ -0,0 +1,222 @@
+# =========================================================
+# ベンチマーク（オフライン）
+# 乱数の種を固定して 前側／奥側／全面 と取消を含む予約を生成し、
+# 読込・衝突判定・週／日表示の計算・保存などの主要経路の所要時間を測る。
+# Sheets は FakeWorksheet（gspread の代わり）、主ストアは一時ディレクトリの SQLite。
+# 起動時（新しいプロセスでのモジュール読込）の所要時間も測る。
+# 結果は JSON で出力するので、版どうしで比較できる。
+#
+#   python bench.py --sizes 1000,10000,100000 --out bench.json
+# =========================================================
+
+import argparse
+import json
+import os
+import platform
+import random
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+
+from model import (
+    SLOT_ENDS, SLOT_ORIGIN, ReservationSnapshot, RoomLayout, build_grid_html, find_free_slots, fmt_minutes,
+    to_records,
+)
+from sheets import SHEET_HEADER, SHEET_KEYS, FakeWorksheet, GSheetStorage, LocalSheetPool, SheetsScheduler
+from storage import SQLiteStorage
+from transfer import csv_chunks
+
+DAY_END = SLOT_ENDS[-1]
+LAYOUT = RoomLayout()   # 既定の 前側／奥側／全面
+
+
+def generate(n, seed=0, full_ratio=0.2, cancel_ratio=0.1, per_day=8, past_ratio=0.8):
+    """保存行を n 件生成する。1日あたり約 per_day 件で、同じ部屋の予約は重ならない"""
+    rng = random.Random(seed)
+    days = max(1, n // per_day)
+    first = date.today() - timedelta(days=int(days * past_ratio))
+    side = (1 - full_ratio) / 2
+    rows, d = [], 0
+    while len(rows) < n:
+        cursor = {"前側": SLOT_ORIGIN, "奥側": SLOT_ORIGIN}
+        for _ in range(per_day):
+            room = rng.choices(["前側", "奥側", "全面"], weights=[side, side, full_ratio])[0]
+            start = max(cursor[p] for p in LAYOUT.parts[room]) + 30 * rng.randrange(0, 3)
+            end = start + 30 * rng.randrange(1, 7)
+            if end > DAY_END:
+                break
+            for p in LAYOUT.parts[room]:
+                cursor[p] = end
+            cancelled = rng.random() < cancel_ratio
+            rows.append({
+                "id": len(rows) + 2, "room": room, "date": (first + timedelta(days=d % days)).isoformat(),
+                "start": fmt_minutes(start), "end": fmt_minutes(end), "user": f"担当{rng.randrange(200)}",
+                "purpose": rng.choice(["", "定例", "打合せ", "研修"]), "ext": str(rng.randrange(100, 999)),
+                "status": "cancel" if cancelled else "active", "cancel": first.isoformat() if cancelled else "",
+            })
+            if len(rows) >= n:
+                break
+        d += 1
+    return rows
+
+
+def measure(fn, repeat):
+    """fn() を repeat 回実行して秒数の統計を返す"""
+    times = []
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - t0)
+    return {"runs": repeat, "min": min(times), "median": statistics.median(times), "max": max(times)}
+
+
+def bench_size(n, repeat, queries, seed, full_ratio, cancel_ratio, workdir):
+    rows = generate(n, seed, full_ratio, cancel_ratio)
+    rng = random.Random(seed + 1)
+    today = date.today()
+    monday = today - timedelta(days=today.weekday())
+    week = [(monday + timedelta(days=i)).toordinal() for i in range(7)]
+    results = {}
+
+    # --- 読込：シート全件 → 保存行 → レコード → スナップショット（索引・日付別） ---
+    sheet = FakeWorksheet([SHEET_HEADER] + [[r[SHEET_KEYS[k]] for k in SHEET_HEADER] for r in rows])
+    mirror = GSheetStorage(LocalSheetPool(sheet, SheetsScheduler(rate_per_minute=10 ** 9, burst=10 ** 9)))
+    results["sheet_load_range"] = measure(mirror.load_range, repeat)
+    results["to_records"] = measure(lambda: to_records(rows, LAYOUT), repeat)
+    records = to_records(rows, LAYOUT)
+    results["snapshot_build"] = measure(lambda: ReservationSnapshot(1, records), repeat)
+    snap = ReservationSnapshot(1, records)
+
+    # --- 主ストア（SQLite）：一括登録と、表示範囲（-4〜+12週）の読込 ---
+    db = SQLiteStorage(os.path.join(workdir, f"bench_{n}.db"))
+    t0 = time.perf_counter()
+    db.insert_many(rows)
+    results["sqlite_insert_many"] = {"runs": 1, "min": time.perf_counter() - t0}
+    lo, hi = (today - timedelta(weeks=4)).isoformat(), (today + timedelta(weeks=12)).isoformat()
+    results["sqlite_load_window"] = measure(lambda: db.load_range(lo, hi), repeat)
+
+    # --- 衝突判定（has_conflict 相当）：ランダムな日・区画・時間帯 ---
+    days = sorted(snap.by_date)
+    probes = []
+    for _ in range(queries):
+        s = SLOT_ORIGIN + 30 * rng.randrange(0, 20)
+        probes.append((LAYOUT.masks[rng.choice(LAYOUT.rooms)], rng.choice(days), s, s + 30 * rng.randrange(1, 5)))
+    results["has_conflict_x%d" % queries] = measure(lambda: [snap.conflicts(*p) for p in probes], repeat)
+
+    # --- 週・日表示のセル計算（占有マスク＋HTML）。毎回新しいスナップショットでキャッシュなし ---
+    def day_rows(s, d, title):
+        return (title, tuple(("", tuple((p, s.occupancy_mask(d, LAYOUT.masks[p])) for p in parts),
+                              s.occupancy_mask(d, whole, every=True)) for _, parts, whole in LAYOUT.groups))
+
+    def week_cells():
+        s = ReservationSnapshot(1, snap.by_id, by_date=snap.by_date, index=snap.index)
+        return build_grid_html(tuple(day_rows(s, d, str(d)) for d in week))
+
+    def day_cells():
+        s = ReservationSnapshot(1, snap.by_id, by_date=snap.by_date, index=snap.index)
+        return build_grid_html((day_rows(s, week[0], ""),), with_full=True)
+
+    results["week_view_cells"] = measure(week_cells, repeat)
+    results["day_view_cells"] = measure(day_cells, repeat)
+
+    # --- 日別一覧と取消候補（全面は1件なので、旧来の統合・重複除去はここに置き換わった） ---
+    def day_list():
+        items = snap.on_date(week[0])
+        table = [(r.room, f"{fmt_minutes(r.start)}〜{fmt_minutes(r.end)}", r.user, r.status) for r in items]
+        cancels = {r.id: r.room for r in sorted(items, key=lambda r: r.start) if r.status == "active"}
+        return table, cancels
+
+    results["day_list_and_cancels"] = measure(day_list, repeat)
+
+    # --- 空き検索（全面・2時間・平日午後・1年） ---
+    results["free_slots_1y"] = measure(
+        lambda: find_free_slots(snap, LAYOUT.masks["全面"], 120, (13 * 60, DAY_END), set(range(5)), today.toordinal(), 365,
+                                limit=10 ** 6), repeat)
+
+    # --- 保存（ミラーへの後書き1回分）：10件の追記と10件の取消をそれぞれ1回の呼び出しで ---
+    batch = [dict(r, status="active", cancel="") for r in rows[:10]]
+    results["sheet_append_10"] = measure(lambda: mirror.insert_many(batch), repeat)
+    targets = [(r["id"], today.isoformat()) for r in rows[:10]]
+    results["sheet_cancel_10"] = measure(lambda: mirror.cancel_many(targets), repeat)
+
+    # --- CSV 書出（全件） ---
+    results["csv_export_all"] = measure(lambda: sum(len(c) for c in csv_chunks(rows)), max(1, repeat // 2))
+
+    return {"reservations": n, "days": len(snap.by_date), "sheet_calls": sheet.call_count, "timings": results}
+
+
+# 起動時に読み込むモジュールの組（ログイン画面までに要るもの／ページを開いたときに要るもの）
+STARTUP_IMPORTS = {
+    "login": "import metrics, model, storage",
+    "sheets": "import sheets",
+    "transfer": "import transfer",
+    "pandas": "import pandas",
+    "streamlit": "import streamlit",
+}
+
+
+def measure_startup(repeat):
+    """STARTUP_IMPORTS の各組を新しいプロセスで読み込む秒数（中央値）。入っていないものは None"""
+    code = "import time; t0 = time.perf_counter(); {}; print(time.perf_counter() - t0)"
+    cwd = os.path.dirname(os.path.abspath(__file__))
+    out = {}
+    for name, stmt in STARTUP_IMPORTS.items():
+        times = []
+        for _ in range(repeat):
+            res = subprocess.run([sys.executable, "-c", code.format(stmt)], capture_output=True, text=True, cwd=cwd)
+            if res.returncode != 0:
+                break
+            times.append(float(res.stdout.strip()))
+        out[name] = statistics.median(times) if times else None
+    return out
+
+
+def git_revision():
+    try:
+        out = subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__)), timeout=5)
+        return out.stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def run(sizes=(1000, 10000, 100000), repeat=5, queries=1000, seed=0, full_ratio=0.2, cancel_ratio=0.1):
+    report = {
+        "revision": git_revision(),
+        "python": platform.python_version(),
+        "params": {"sizes": list(sizes), "repeat": repeat, "queries": queries, "seed": seed,
+                   "full_ratio": full_ratio, "cancel_ratio": cancel_ratio},
+        "startup_imports": measure_startup(repeat),
+        "results": [],
+    }
+    with tempfile.TemporaryDirectory() as workdir:
+        for n in sizes:
+            report["results"].append(bench_size(n, repeat, queries, seed, full_ratio, cancel_ratio, workdir))
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="会議室予約の主要経路のベンチマーク")
+    ap.add_argument("--sizes", default="1000,10000,100000", help="予約件数（カンマ区切り、最大 1000000 程度）")
+    ap.add_argument("--repeat", type=int, default=5)
+    ap.add_argument("--queries", type=int, default=1000, help="衝突判定の問い合わせ数")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--full-ratio", type=float, default=0.2, help="全面の割合")
+    ap.add_argument("--cancel-ratio", type=float, default=0.1, help="取消の割合")
+    ap.add_argument("--out", help="JSON の出力先（省略時は標準出力）")
+    args = ap.parse_args()
+    report = run([int(s) for s in args.sizes.split(",")], args.repeat, args.queries, args.seed,
+                 args.full_ratio, args.cancel_ratio)
+    text = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+
+
+if __name__ == "__main__":
+    main()
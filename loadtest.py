@@ -0,0 +1,115 @@
+# =========================================================
+# Sheets スケジューラの負荷試験（オフライン）
+# FakeWorksheet（遅延・クォータ超過を注入）に対して、複数セッションが同時に
+# 読込・登録・取消を行う状況を再現し、SheetsScheduler 経由の結果を集計する。
+#
+#   python loadtest.py --sessions 20 --duration 30 --latency 0.3 --quota 60
+# =========================================================
+
+import argparse
+import json
+import random
+import threading
+import time
+from datetime import date, timedelta
+
+from sheets import SHEET_HEADER, FakeWorksheet, GSheetStorage, LocalSheetPool, SheetsScheduler
+
+
+def percentile(values, q):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+def seed_rows(n, rng):
+    today = date.today()
+    rows = [SHEET_HEADER]
+    for i in range(n):
+        h = rng.randrange(9, 19)
+        rows.append([rng.choice(["前側", "奥側", "全面"]), str(today + timedelta(days=rng.randrange(-60, 60))),
+                     f"{h:02d}:00", f"{h + 1:02d}:00", "試験", "", "", "active", "", i + 1])
+    return rows
+
+
+def session(storage, rng, stop, think, results, lock):
+    """1セッション分：読込（相乗り対象）・登録・取消をランダムに繰り返す"""
+    mine = []
+    while not stop.is_set():
+        op = rng.choices(["read", "insert", "cancel"], weights=[6, 3, 1])[0]
+        t0 = time.perf_counter()
+        try:
+            if op == "read":
+                storage.load_range()
+            elif op == "insert":
+                h = rng.randrange(9, 19)
+                mine.append(storage.insert({"room": rng.choice(["前側", "奥側"]), "date": str(date.today()),
+                                            "start": f"{h:02d}:00", "end": f"{h + 1:02d}:00", "user": "負荷"}))
+            elif mine:
+                storage.cancel([mine.pop()], str(date.today()))
+            ok = True
+        except Exception:
+            ok = False
+        with lock:
+            results.append((op, ok, time.perf_counter() - t0))
+        stop.wait(rng.expovariate(1 / think) if think else 0)
+
+
+def run(sessions=20, duration=30.0, latency=0.3, jitter=0.1, quota=60, rate=50, burst=10, rows=2000,
+        think=2.0, seed=0):
+    rng = random.Random(seed)
+    sheet = FakeWorksheet(seed_rows(rows, rng), latency=latency, jitter=jitter, quota_per_minute=quota)
+    scheduler = SheetsScheduler(rate_per_minute=rate, burst=burst)
+    storage = GSheetStorage(LocalSheetPool(sheet, scheduler))
+    stop, lock, results = threading.Event(), threading.Lock(), []
+    threads = [threading.Thread(target=session, args=(storage, random.Random(seed + i + 1), stop, think, results, lock))
+               for i in range(sessions)]
+    t0 = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - t0
+
+    report = {
+        "params": {"sessions": sessions, "duration": duration, "latency": latency, "quota_per_minute": quota,
+                   "rate_per_minute": rate, "burst": burst, "rows": rows, "think": think, "seed": seed},
+        "elapsed": round(elapsed, 3),
+        "sheet_calls": sheet.call_count,
+        "scheduler": {k: round(v, 3) if isinstance(v, float) else v for k, v in scheduler.stats.items()},
+        "sheet_latency": scheduler.latency.to_dict(),
+        "sheet_ops": scheduler.ops,
+        "ops": {},
+    }
+    for op in ("read", "insert", "cancel"):
+        lat = [t for o, ok, t in results if o == op and ok]
+        report["ops"][op] = {
+            "ok": len(lat),
+            "failed": sum(1 for o, ok, _ in results if o == op and not ok),
+            "p50": round(percentile(lat, 0.5), 3),
+            "p95": round(percentile(lat, 0.95), 3),
+        }
+    return report
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Sheets スケジューラのオフライン負荷試験")
+    ap.add_argument("--sessions", type=int, default=20)
+    ap.add_argument("--duration", type=float, default=30.0)
+    ap.add_argument("--latency", type=float, default=0.3, help="Fake シートの1呼び出しあたり遅延（秒）")
+    ap.add_argument("--jitter", type=float, default=0.1)
+    ap.add_argument("--quota", type=int, default=60, help="Fake シートの毎分クォータ")
+    ap.add_argument("--rate", type=int, default=50, help="スケジューラの毎分上限")
+    ap.add_argument("--burst", type=int, default=10)
+    ap.add_argument("--rows", type=int, default=2000)
+    ap.add_argument("--think", type=float, default=2.0, help="セッションの操作間隔の平均（秒）")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+    print(json.dumps(run(**vars(args)), ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
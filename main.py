@@ -2,20 +2,295 @@
 # 中大生協 会議室予約システム v3.4.7 Full（Memory Extension, Fixed)
 # - GCPスコープ明示（RefreshError防止）
 # - Sheets保存時は《全面》を1行に統合
-# - 読込時は《全面》を前側/奥側の2件に復元（内部処理互換）
-# - 取消候補は重複除去（全面1行のみ表示）
+# - 《全面》は内部でも1件（mask = 前側＋奥側）として保持し、id で取消
+# - 部屋・区画は secrets の [rooms] で追加できる（合わせて使う区画は最小単位の部屋の和）
 # =========================================================
 
+import logging
+import os
+import threading
+import io
+import time
+import uuid
 import streamlit as st
-import pandas as pd
-from datetime import datetime, timedelta, time
-import gspread
-from google.oauth2.service_account import Credentials
+from datetime import datetime, timedelta
+from functools import partial
+from metrics import Metrics
+from model import (
+    EMPTY_SNAPSHOT, SLOT_ENDS, SLOT_MINUTES, SLOT_STARTS, TIME_SLOTS, Reservation, ReservationSnapshot,
+    RoomLayout, build_grid_html, find_free_slots, fmt_minutes, index_add, index_overlaps, row_conflicts,
+    to_minutes, to_records,
+)
+from storage import MirroredStorage, SQLiteStorage
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
 
 # -------------------------------------------------------------
 # ページ設定
 # -------------------------------------------------------------
 st.set_page_config(page_title="中大生協 会議室予約システム", layout="wide")
+script_started = time.perf_counter()
+
+# -------------------------------------------------------------
+# 永続化設定（SQLite 主ストア＋Google Sheets ミラー）
+# -------------------------------------------------------------
+SHEET_ID = "1ebbNq681Loz2r-_Wkgbd_6qABN_H1GzsG2Ja0p9JJOg"
+DB_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "reservations.db")
+AUTO_REFRESH_SECONDS = 5   # 週・日表示で他セッションの変更を確かめる間隔（秒）
+
+def _secrets_section(name):
+    try:
+        return st.secrets.get(name)
+    except FileNotFoundError:  # secrets.toml なし（ローカル・オフライン実行）
+        return None
+
+@st.cache_resource
+def get_storage():
+    """主ストアはローカルSQLite。Sheets の認証情報があればミラーとして非同期に反映する
+
+    ミラーへの接続と初回の取込は送信スレッドが行い、失敗しても間隔を空けて再試行する。
+    その間の書込みも送信待ちに積まれ、つながった時点でまとめて反映される。
+    """
+    cfg = _secrets_section("storage") or {}
+    primary = SQLiteStorage(cfg.get("sqlite_path", DB_PATH))
+    creds = _secrets_section("gcp_service_account")
+    if not creds or cfg.get("mirror", "gsheet") != "gsheet":
+        return primary
+    from sheets import GSheetPool, GSheetStorage, SheetsScheduler
+    # Sheets への呼び出しはすべてこの1つのスケジューラ（毎分の上限）を通る
+    scheduler = SheetsScheduler(rate_per_minute=cfg.get("sheets_rate_per_minute", 50))
+    mirror = GSheetStorage(GSheetPool(creds, SHEET_ID, scheduler), archive_by=cfg.get("archive_by", "month"))
+    # archive_after_days 日より前の行と取消済みの行は、毎日アーカイブシートへ移す（0 で無効）
+    return MirroredStorage(primary, mirror, archive_after_days=cfg.get("archive_after_days", 28))
+
+# -------------------------------------------------------------
+# 部屋の定義
+# -------------------------------------------------------------
+@st.cache_resource
+def get_room_layout():
+    """secrets の [rooms.<部屋名>] parts / composites（なければ 会議室＝前側・奥側・全面）
+
+    例: [rooms.第2会議室]
+        parts = ["第2A", "第2B"]
+        composites = { "第2全体" = ["第2A", "第2B"] }
+    """
+    return RoomLayout(_secrets_section("rooms"))
+
+# -------------------------------------------------------------
+# 計測（診断ページ用）
+# -------------------------------------------------------------
+@st.cache_resource
+def get_metrics():
+    """再実行ごとの区間計測。secrets の [diagnostics] json_logs = true で1回ごとに JSON ログも出す"""
+    cfg = _secrets_section("diagnostics") or {}
+    return Metrics(json_logs=bool(cfg.get("json_logs", False)))
+
+# -------------------------------------------------------------
+# 共有スナップショットの置き場
+# -------------------------------------------------------------
+class SnapshotStore:
+    """現行スナップショットの置き場（サーバープロセスで1つ）。
+
+    get() は保存先の版番号を POLL_INTERVAL ごとに確かめ、動いたときだけ
+    その後に変わった行を読んで差分で反映する。全体を読み直すのは初回・
+    日付が変わったとき・invalidate() 後だけ。
+    自セッションの書込み後は apply() で即座に差し替える。
+    読み込むのは今日の前後 window_days=(過去日数, 未来日数) だけで、
+    それより前後の週は ensure() で表示するときに読み足す。
+    """
+    POLL_INTERVAL = 1.0
+
+    def __init__(self, window_days=(28, 84)):
+        self.window_days = window_days
+        self._lock = threading.Lock()
+        self._snapshot = None
+        self._loaded_day = None
+        self._polled_at = 0.0
+        self._version = 0
+
+    def _fresh(self):
+        return (self._loaded_day == datetime.now().toordinal()
+                and time.monotonic() - self._polled_at < self.POLL_INTERVAL)
+
+    def _window(self):
+        today = datetime.now().toordinal()
+        return today - self.window_days[0], today + self.window_days[1] + 1
+
+    def get(self):
+        metrics = get_metrics()
+        if self._fresh():
+            metrics.count("snapshot.hit")
+            return self._snapshot
+        with self._lock:
+            if self._fresh():
+                metrics.count("snapshot.hit")
+                return self._snapshot
+            revision = get_storage().revision()
+            snap, today = self._snapshot, datetime.now().toordinal()
+            if snap is None or self._loaded_day != today:
+                window = self._window()
+                self._version += 1
+                with metrics.span("load.read"):
+                    records = load_reservations(*window)
+                with metrics.span("index.build"):
+                    self._snapshot = ReservationSnapshot(self._version, records, window, revision=revision)
+                self._loaded_day = today
+                metrics.count("snapshot.full")
+            elif revision != snap.revision:
+                self._version += 1
+                with metrics.span("load.delta"):
+                    self._snapshot = snap.with_changes(self._version, load_changes(snap.revision), revision)
+                metrics.count("snapshot.delta")
+            else:
+                metrics.count("snapshot.poll")
+            self._polled_at = time.monotonic()
+            return self._snapshot
+
+    def ensure(self, lo, hi):
+        """[lo, hi)（序数）を読込済みのスナップショットを返す。足りない前後の分だけ保存先から読む"""
+        snap = self.get()
+        if snap.covers(lo, hi):
+            return snap
+        with self._lock:
+            snap = self._snapshot
+            if snap.covers(lo, hi):
+                return snap
+            (old_lo, old_hi), loaded = snap.window, {}
+            lo, hi = min(lo, old_lo), max(hi, old_hi)
+            if lo < old_lo:
+                loaded.update(load_reservations(lo, old_lo))
+            if old_hi < hi:
+                loaded.update(load_reservations(old_hi, hi))
+            self._version += 1
+            self._snapshot = snap.with_added(
+                self._version, [r for rid, r in loaded.items() if rid not in snap.by_id], window=(lo, hi))
+            return self._snapshot
+
+    def apply(self, change):
+        """change(現行スナップショット, 新しい版番号) の結果を現行にする"""
+        with self._lock:
+            self._version += 1
+            self._snapshot = change(self._snapshot or EMPTY_SNAPSHOT, self._version)
+            return self._snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._loaded_day = None
+
+@st.cache_resource
+def get_snapshot_store():
+    cfg = _secrets_section("storage") or {}
+    window = (7 * cfg.get("window_past_weeks", 4), 7 * cfg.get("window_future_weeks", 12))
+    return SnapshotStore(window_days=window)
+
+def load_reservations(lo, hi):
+    """日付の序数 [lo, hi) の予約を保存先から読み込み、id → レコードで返す（全面も1件）"""
+    return to_records(get_storage().load_range(datetime.fromordinal(lo).date().isoformat(),
+                                               datetime.fromordinal(hi).date().isoformat()), get_room_layout())
+
+def load_changes(since):
+    """版番号 since より後に追加・取消された予約のレコード"""
+    return list(to_records(get_storage().load_changes(since), get_room_layout()).values())
+
+def refresh_snapshot():
+    """現行スナップショットへの参照をセッションに置く（コピーはしない）"""
+    try:
+        with get_metrics().span("load"):
+            st.session_state["snapshot"] = get_snapshot_store().get()
+    except Exception as e:
+        st.warning(f"予約データの読み込みに失敗しました。{e}")
+        st.session_state.setdefault("snapshot", EMPTY_SNAPSHOT)
+
+@st.experimental_fragment(run_every=AUTO_REFRESH_SECONDS)
+def watch_changes():
+    """他のセッション・プロセスの書込みで版番号が動いたら画面を描き直す
+
+    版番号の確認はローカルDBへの1クエリ（プロセス全体で POLL_INTERVAL に1回）だけで、
+    Google Sheets は読まない。
+    """
+    if get_snapshot_store().get().revision != st.session_state["snapshot"].revision:
+        st.experimental_rerun()
+
+def ensure_loaded(first, last):
+    """first〜last（date）が読込範囲外なら読み足し、セッションの参照を差し替える"""
+    try:
+        with get_metrics().span("load"):
+            st.session_state["snapshot"] = get_snapshot_store().ensure(first.toordinal(), last.toordinal() + 1)
+    except Exception as e:
+        st.warning(f"予約データの読み込みに失敗しました。{e}")
+
+def render_sync_status():
+    """Google Sheets への後書き状況（送信待ち件数と最古の待ち時間）をサイドバーに表示"""
+    storage = get_storage()
+    if not isinstance(storage, MirroredStorage):
+        return
+    count, age, error = storage.sync_status()
+    if count:
+        st.sidebar.warning(f"⏳ Google Sheets 反映待ち：{count}件（最古 {age:.0f}秒）")
+        if error:
+            st.sidebar.caption(f"直近のエラー：{error}")
+    else:
+        st.sidebar.caption("✅ Google Sheets に反映済み")
+
+# -------------------------------------------------------------
+# 起動時の読込（サーバープロセスで1回）
+# -------------------------------------------------------------
+# 予約を表示するページ。保存先（SQLite・Sheets）にはこれらのページでだけ触れる
+DATA_PAGES = ("week_view", "day_view", "search", "transfer", "analytics")
+
+@st.cache_resource
+def start_warm_up():
+    """保存先への接続と予約の読込を別スレッドで始める（プロセスで1回だけ）
+
+    最初のセッションのログイン画面から呼ぶので、パスワード入力の間に読込が終わり、
+    最初の利用者が予約の表示を待たずに済む。所要時間は診断ページの「起動時」に出る。
+    """
+    metrics = get_metrics()
+
+    def _warm():
+        t0 = time.perf_counter()
+        try:
+            get_storage()
+            metrics.mark_startup("storage_open", time.perf_counter() - t0)
+            t1 = time.perf_counter()
+            get_snapshot_store().get()
+            metrics.mark_startup("snapshot_load", time.perf_counter() - t1)
+            metrics.mark_startup("warm_up_total", time.perf_counter() - t0)
+        except Exception:
+            logging.getLogger(__name__).exception("起動時の予約データの読込に失敗しました（表示時に読み直します）")
+
+    thread = threading.Thread(target=_warm, name="warm-up", daemon=True)
+    add_script_run_ctx(thread)   # st.cache_resource をスレッドから使うため
+    thread.start()
+    return thread
+
+start_warm_up()
+
+@st.cache_resource
+def start_api():
+    """secrets の [api] port があれば、空き状況の JSON API（api.py）を別スレッドで開く（プロセスで1回）
+
+    例: [api]
+        host = "0.0.0.0"   # 省略時は 127.0.0.1（このサーバー内からだけ）
+        port = 8502
+    アプリと同じ共有スナップショットから返すので、Sheets は読まない。
+    """
+    cfg = _secrets_section("api") or {}
+    if not cfg.get("port"):
+        return None
+    from api import AvailabilityServer
+    ctx = get_script_run_ctx()
+    try:
+        server = AvailabilityServer(
+            (cfg.get("host", "127.0.0.1"), int(cfg["port"])), get_snapshot_store().ensure, get_room_layout(),
+            metrics=get_metrics(),
+            # st.cache_resource をリクエストのスレッドから使うため
+            thread_setup=lambda: add_script_run_ctx(threading.current_thread(), ctx))
+    except OSError:
+        logging.getLogger(__name__).exception("空き状況 API を開けませんでした（ポート %s）", cfg["port"])
+        return None
+    return server.start()
+
+start_api()
 
 # -------------------------------------------------------------
 # ログイン認証（必要ならPASSWORDを設定）
@@ -34,6 +309,9 @@ if not st.session_state["authenticated"]:
                 st.experimental_rerun()
             else:
                 st.error("パスワードが違います。")
+    login_seconds = time.perf_counter() - script_started
+    get_metrics().record("render.login", login_seconds)
+    get_metrics().mark_startup("first_login_render", login_seconds)
     st.stop()
 
 # -------------------------------------------------------------
@@ -43,238 +321,225 @@ if "page" not in st.session_state:
     st.session_state["page"] = "calendar"
 if "selected_date" not in st.session_state:
     st.session_state["selected_date"] = datetime.now().date()
-if "reservations" not in st.session_state:
-    st.session_state["reservations"] = {"前側": [], "奥側": []}
 if "pending_register" not in st.session_state:
     st.session_state["pending_register"] = None
 if "pending_cancel" not in st.session_state:
     st.session_state["pending_cancel"] = None
+if "session_id" not in st.session_state:
+    st.session_state["session_id"] = uuid.uuid4().hex[:8]
+if "snapshot" not in st.session_state:
+    st.session_state["snapshot"] = EMPTY_SNAPSHOT
 
-# -------------------------------------------------------------
-# Google Sheets 永続化設定
-# -------------------------------------------------------------
-SHEET_ID = "1ebbNq681Loz2r-_Wkgbd_6qABN_H1GzsG2Ja0p9JJOg"
-
-def get_gsheet():
-    SCOPES = [
-        "https://www.googleapis.com/auth/spreadsheets",
-        "https://www.googleapis.com/auth/drive"
-    ]
-    creds = Credentials.from_service_account_info(
-        st.secrets["gcp_service_account"],
-        scopes=SCOPES
-    )
-    client = gspread.authorize(creds)
-    sheet = client.open_by_key(SHEET_ID).sheet1
-    return sheet
-
-@st.cache_data(ttl=30)
-def load_reservations_from_gsheet():
-    """Sheetsから読み込み。全面1行は内部で前側/奥側の2件に展開し、user名は(全面)を付与して互換維持"""
-    try:
-        sheet = get_gsheet()
-        records = sheet.get_all_records()
-        st.session_state["reservations"] = {"前側": [], "奥側": []}
-        for row in records:
-            room = row.get("区画", "")
-            date = row.get("日付", "")
-            start = row.get("開始", "")
-            end = row.get("終了", "")
-            user = row.get("担当者", "")
-            purpose = row.get("目的", "")
-            ext = row.get("内線", "")
-            status = row.get("状態", "")
-            cancel = row.get("取消日", "")
-
-            if room == "全面":
-                for sub in ["前側", "奥側"]:
-                    st.session_state["reservations"][sub].append({
-                        "date": date,
-                        "start": start,
-                        "end": end,
-                        "user": f"{user}(全面)",
-                        "purpose": purpose,
-                        "ext": ext,
-                        "status": status or "active",
-                        "cancel": cancel or "",
-                    })
-            elif room in ["前側", "奥側"]:
-                st.session_state["reservations"][room].append({
-                    "date": date,
-                    "start": start,
-                    "end": end,
-                    "user": user,
-                    "purpose": purpose,
-                    "ext": ext,
-                    "status": status or "active",
-                    "cancel": cancel or "",
-                })
-        st.caption("📗 Google Sheetsから既存データを読み込みました。")
-    except Exception as e:
-        st.warning(f"Google Sheetsの読み込みに失敗しました（初回または権限）。{e}")
-
-def save_reservations_to_gsheet():
-    """内部の前側/奥側データを、Sheets保存時に《全面》1行へ統合（同一キーで両室が揃っていれば全面）"""
-    try:
-        sheet = get_gsheet()
-
-        def _norm_user(u: str) -> str:
-            return (u or "").replace("(全面)", "")
-
-        # keyでグルーピング（前側/奥側の揃いを検出）
-        buf = {}  # key -> {"rooms": set(), "purpose": str, "ext": str}
-        # key = (date, start, end, user_norm, status, cancel)
-        for room, items in st.session_state["reservations"].items():
-            for r in items:
-                key = (
-                    str(r.get("date")),
-                    r.get("start"),
-                    r.get("end"),
-                    _norm_user(r.get("user", "")),
-                    r.get("status", "active"),
-                    r.get("cancel", ""),
-                )
-                if key not in buf:
-                    buf[key] = {"rooms": set(), "purpose": r.get("purpose", ""), "ext": r.get("ext", "")}
-                buf[key]["rooms"].add(room)
-                # latest purpose/ext wins（同一キー内で差異ない前提）
-
-        # 書き出し配列を生成
-        all_data = []
-        for (date, start, end, user_norm, status, cancel), meta in buf.items():
-            out_room = "全面" if {"前側", "奥側"}.issubset(meta["rooms"]) else list(meta["rooms"])[0]
-            all_data.append([
-                out_room, date, start, end, user_norm,  # （全面）は外した素の担当者名で保存
-                meta.get("purpose", ""), meta.get("ext", ""),
-                status, cancel
-            ])
-
-        # ヘッダ＋本体で更新
-        sheet.clear()
-        sheet.update([
-            ["区画", "日付", "開始", "終了", "担当者", "目的", "内線", "状態", "取消日"],
-            *all_data
-        ])
-        st.caption("💾 Google Sheetsに保存しました。")
-    except Exception as e:
-        st.error(f"Google Sheetsへの保存に失敗しました: {e}")
-
-# 起動時にデータ読込
-load_reservations_from_gsheet()
-
-ROOMS = ["前側", "奥側", "全面"]
-TIME_SLOTS = [f"{h:02d}:{m:02d}" for h in range(9, 21) for m in (0, 30)]
+# 予約は各ページが ensure_loaded で現行スナップショットを参照する（版番号が動いていなければ読込なし）。
+# カレンダー・診断ページでは保存先に触れない
+get_metrics().begin_run(st.session_state["session_id"], st.session_state["page"])
+if st.session_state["page"] in DATA_PAGES:
+    render_sync_status()
 
 # -------------------------------------------------------------
 # 関数定義（UI内ロジック）
 # -------------------------------------------------------------
-def parse_time(tstr):
-    h, m = map(int, tstr.split(":"))
-    return time(h, m)
-
-def overlap(start1, end1, start2, end2):
-    return start1 < end2 and start2 < end1
-
 def has_conflict(room, date, start, end):
-    """全面予約時は前/奥のどちらかに衝突があれば不可"""
-    date_str = str(date)
-    # 既存の全面扱い（userが(全面)付き）のブロッキング
-    for subroom in ["前側", "奥側"]:
-        for r in st.session_state["reservations"][subroom]:
-            if str(r.get("date")) == date_str and r.get("status") == "active" and r["user"].endswith("(全面)"):
-                if overlap(parse_time(r["start"]), parse_time(r["end"]), parse_time(start), parse_time(end)):
-                    return True
-    targets = ["前側", "奥側"] if room == "全面" else [room]
-    for sub in targets:
-        for r in st.session_state["reservations"][sub]:
-            if str(r.get("date")) == date_str and r.get("status", "active") == "active":
-                s1, e1 = parse_time(r["start"]), parse_time(r["end"])
-                s2, e2 = parse_time(start), parse_time(end)
-                if overlap(s1, e1, s2, e2):
-                    return True
-    return False
-
-def register_reservation(room, date, start, end, user, purpose, ext):
-    if room == "全面":
-        # 片側にでも衝突があれば全面不可
-        for subroom in ["前側", "奥側"]:
-            if has_conflict(subroom, date, start, end):
-                st.warning(f"{subroom}に既存の予約があります。全面予約できません。")
+    """区画が使う部屋のどれかに衝突があれば不可（全面なら前/奥のどちらか。start/end は0時からの分）"""
+    return st.session_state["snapshot"].conflicts(get_room_layout().masks[room], date.toordinal(), start, end)
+
+def recurrence_dates(first, until, every_weeks=1, excluded=()):
+    """first から until まで every_weeks 週ごとの日付（excluded の日は除く）"""
+    excluded = set(excluded)
+    dates, d = [], first
+    while d <= until:
+        if d not in excluded:
+            dates.append(d)
+        d += timedelta(weeks=every_weeks)
+    return dates
+
+def split_conflicts(room, dates, start, end):
+    """dates を (登録できる日, 衝突する日) に分ける。各日のインデックスを1回引くだけ"""
+    ok, clash = [], []
+    for d in dates:
+        (clash if has_conflict(room, d, start, end) else ok).append(d)
+    return ok, clash
+
+def register_reservation(room, dates, start, end, user, purpose, ext):
+    """dates の各日に同じ区画・時間帯で登録する（繰り返し予約も1回の書込みにまとめる）"""
+    ensure_loaded(min(dates), max(dates))
+    layout = get_room_layout()
+    if layout.is_composite(room) and len(dates) == 1:
+        # 一部の部屋にでも衝突があれば不可（どの部屋かを知らせる）
+        for subroom in layout.parts[room]:
+            if has_conflict(subroom, dates[0], start, end):
+                st.warning(f"{subroom}に既存の予約があります。{room}予約できません。")
                 return
-        for subroom in ["前側", "奥側"]:
-            new = {
-                "date": str(date),
-                "start": start,
-                "end": end,
-                "user": f"{user}(全面)",
-                "purpose": purpose,
-                "ext": ext,
-                "status": "active",
-                "cancel": "",
-            }
-            st.session_state["reservations"][subroom].append(new)
-        save_reservations_to_gsheet()
-        st.session_state["pending_register"] = None
-        st.success("✅ 全面予約を登録しました。")
-        st.experimental_rerun()
-    else:
-        new = {
-            "date": str(date),
-            "start": start,
-            "end": end,
+    # 確認中に他のセッションが入れた予約と重なる日は登録しない（スナップショットでの早めの判定）
+    dates, clash = split_conflicts(room, dates, start, end)
+    if not dates:
+        st.warning("⚠️ この時間帯はすでに予約されています。")
+        return
+    rows = [
+        {
+            "room": room,
+            "date": d.isoformat(),
+            "start": fmt_minutes(start),
+            "end": fmt_minutes(end),
             "user": user,
             "purpose": purpose,
             "ext": ext,
             "status": "active",
             "cancel": "",
         }
-        st.session_state["reservations"][room].append(new)
-        save_reservations_to_gsheet()
+        for d in dates
+    ]
+    # 確定は保存先の最新の状態で日付ごとにもう一度判定する（スナップショットは最大 POLL_INTERVAL 秒古い）
+    try:
+        with get_metrics().span("save"):
+            ids, rejected = get_storage().insert_checked(rows, partial(row_conflicts, layout=layout))
+    except Exception as e:
+        st.error(f"予約データの保存に失敗しました: {e}")
+        return
+    if rejected:
+        get_metrics().count("commit.rejected", len(rejected))
+        lost = {r["date"] for r in rejected}
+        clash = sorted(clash + [d for d in dates if d.isoformat() in lost])
+        rows = [row for row in rows if row["date"] not in lost]
+    if not rows:
         st.session_state["pending_register"] = None
+        st.warning("⚠️ この時間帯は、確定の直前に他の方が予約しました。")
+        return
+    new = [Reservation.from_row({**row, "id": rid}, layout) for row, rid in zip(rows, ids)]
+    st.session_state["snapshot"] = get_snapshot_store().apply(lambda snap, v: snap.with_added(v, new))
+    st.session_state["pending_register"] = None
+    if len(rows) > 1:
+        st.success(f"✅ {len(rows)}件の予約を登録しました。")
+    elif layout.is_composite(room):
+        st.success(f"✅ {room}予約を登録しました。")
+    else:
         st.success("✅ 登録が完了しました。")
-        st.experimental_rerun()
+    if clash:
+        st.warning("衝突のため登録しなかった日：" + "、".join(day_title(d) for d in clash))
+    st.experimental_rerun()
 
-def cancel_reservation(room, user, start, end, date):
-    for r in st.session_state["reservations"][room]:
-        if (
-            (r["user"] == user or r["user"] == f"{user}(全面)" or user in r["user"])
-            and r["start"] == start
-            and r["end"] == end
-            and str(r["date"]) == str(date)
-            and r.get("status") == "active"
-        ):
-            r["status"] = "cancel"
-            r["cancel"] = datetime.now().strftime("%Y-%m-%d")
-    save_reservations_to_gsheet()
+def validate_import(rows):
+    """取込行 (行番号, 保存行) を検証する → (登録する行, [(行番号, 理由)])
+
+    既存の予約・同じファイル内で先に受け付けた行と、区画・日付・時刻・担当者・状態が同じ行は
+    登録済みとして取り込まない（同じファイルの再取込や、書出したファイルの取込で二重にならないように）。
+    有効な行は、さらに既存の予約・ファイル内の行と重なりを判定する。
+    既存の予約は、読込範囲内の日はセッションのスナップショットで、範囲外の日は
+    ファイル中のその日付の範囲を保存先から1回だけ読んで確かめる（共有スナップショットは広げない）。
+    """
+    layout = get_room_layout()
+    snapshot = st.session_state["snapshot"]
+
+    def key(r):
+        return r.room, r.day, r.start, r.end, r.user, r.status
+
+    parsed, errors = [], []
+    for line, row in rows:
+        try:
+            parsed.append((line, row, Reservation.from_row({**row, "id": None}, layout)))
+        except (KeyError, ValueError):
+            errors.append((line, "区画・日付・時刻が読めません"))
+    outside = [r.day for _, _, r in parsed if not snapshot.covers(r.day, r.day + 1)]
+    existing, seen = {}, set()
+    if outside:
+        for r in load_reservations(min(outside), max(outside) + 1).values():
+            index_add(existing, r)
+            seen.add(key(r))
+    accepted, batch = [], {}
+    for line, row, r in parsed:
+        inside = snapshot.covers(r.day, r.day + 1)
+        if r.end <= r.start:
+            errors.append((line, "終了時刻が開始より前です"))
+        elif r.status not in ("active", "cancel"):
+            errors.append((line, f"状態が不明です（{r.status}）"))
+        elif key(r) in seen or (inside and any(key(x) == key(r) for x in snapshot.on_date(r.day))):
+            errors.append((line, "同じ予約が既に登録されています"))
+        elif r.status == "active" and (
+                (snapshot.conflicts(r.mask, r.day, r.start, r.end) if inside
+                 else index_overlaps(existing, r.mask, r.day, r.start, r.end))
+                or index_overlaps(batch, r.mask, r.day, r.start, r.end)):
+            errors.append((line, "既存の予約またはファイル内の別の行と重なっています"))
+        else:
+            accepted.append(row)
+            index_add(batch, r)
+            seen.add(key(r))
+    return accepted, sorted(errors)
+
+def cancel_reservation(rid):
+    """id で指定した予約（全面も1件）を取消す"""
+    r = st.session_state["snapshot"].by_id.get(rid)
+    if r is None or r.status != "active":
+        st.session_state["pending_cancel"] = None
+        st.warning("⚠️ この予約は見つからないか、すでに取り消されています。")
+        return
+    new = r._replace(status="cancel", cancel=datetime.now().strftime("%Y-%m-%d"))
+    try:
+        with get_metrics().span("save"):
+            done = get_storage().cancel([rid], new.cancel)
+    except Exception as e:
+        st.error(f"予約データの保存に失敗しました: {e}")
+        return
     st.session_state["pending_cancel"] = None
-    st.success("🗑️ 予約を取り消しました。")
+    if not done:
+        st.warning("⚠️ この予約は、確定の直前に他の方が取り消しました。")
+        return
+    st.session_state["snapshot"] = get_snapshot_store().apply(lambda snap, v: snap.with_cancelled(v, [new]))
+    composite = get_room_layout().is_composite(r.room)
+    st.success(f"🗑️ {r.room}予約を取り消しました。" if composite else "🗑️ 予約を取り消しました。")
     st.experimental_rerun()
+
+# -------------------------------------------------------------
+# インジケータ描画（週・日をそれぞれ1つの HTML にまとめる）
+# -------------------------------------------------------------
+WEEKDAYS = ["月", "火", "水", "木", "金", "土", "日"]
+
+@st.cache_data(max_entries=256, show_spinner=False)
+def grid_html(days, with_full=False):
+    """インジケータ全体を1つの HTML にする（days は day_masks の結果のタプル）
+
+    引数が占有データそのものなので、予約に変化のない週へ移動したときは
+    キャッシュ済みの文字列がそのまま返る。
+    """
+    get_metrics().count("grid.misses")
+    return build_grid_html(days, with_full)
+
+def render_grid(dates, with_full=False, titled=False, groups=None):
+    """dates の占有マスクを引いてインジケータを描画する（計測区間 bitmap）"""
+    metrics = get_metrics()
+    with metrics.span("bitmap"):
+        html = grid_html(tuple(day_masks(d, day_title(d) if titled else "", groups) for d in dates), with_full)
+    metrics.count("grid.requests")
+    st.markdown(html, unsafe_allow_html=True)
+
+def day_masks(date, title="", groups=None):
+    """1日分のインジケータの行：(見出し, ((部屋名, ((part, マスク), ...), 満マスク), ...))
+
+    groups は表示する部屋名（None なら全部屋）。部屋が1つだけなら部屋名の見出しは出さない。
+    """
+    layout, snap, day = get_room_layout(), st.session_state["snapshot"], date.toordinal()
+    named = len(layout.groups) > 1
+    return (title, tuple(
+        (group if named else "",
+         tuple((p, snap.occupancy_mask(day, layout.masks[p])) for p in parts),
+         snap.occupancy_mask(day, whole, every=True))
+        for group, parts, whole in layout.groups if groups is None or group in groups
+    ))
+
+def day_title(date):
+    return f"{date.strftime('%Y-%m-%d')}（{WEEKDAYS[date.weekday()]}）"
+
 def render_day_indicator(date):
-    """既存の“日別インジケータ”描画ロジックを日単位で再利用（閲覧専用）"""
-    weekday_map = ["月", "火", "水", "木", "金", "土", "日"]
-    w = weekday_map[date.weekday()]
-
-    for layer in ["前側", "奥側"]:
-        row = [
-            f"<div style='width:60px;text-align:center;font-weight:600;font-size:14px;border:1px solid #999;background:#f9f9f9;'>{layer}</div>"
-        ]
-        for slot in TIME_SLOTS:
-            s0 = parse_time(slot)
-            e0 = (datetime.combine(datetime.today(), s0) + timedelta(minutes=30)).time()
-            active = any(
-                r["status"] == "active"
-                and str(r["date"]) == str(date)
-                and overlap(parse_time(r["start"]), parse_time(r["end"]), s0, e0)
-                for r in st.session_state["reservations"][layer]
-            )
-            color = "#ffcccc" if active else "#ccffcc"
-            text = f"<span style='font-size:12px;font-weight:500;'>{slot}</span>"
-            row.append(
-                f"<div style='flex:1;background:{color};border:1px solid #aaa;text-align:center;padding:2px;'>{text}</div>"
-            )
-        st.markdown(f"<div style='display:flex;'>{''.join(row)}</div>", unsafe_allow_html=True)
+    """日単位のインジケータ（閲覧専用）"""
+    render_grid([date])
     st.markdown("---")
 
+# 診断ページへの入口（パスワードは診断ページ側で確認）
+if st.sidebar.button("🩺 診断"):
+    st.session_state["page"] = "diagnostics"
+    st.experimental_rerun()
+
+render_started = time.perf_counter()
+
 # -------------------------------------------------------------
 # カレンダー画面
 # -------------------------------------------------------------
@@ -295,6 +560,18 @@ if st.session_state["page"] == "calendar":
         st.session_state["page"] = "week_view"
         st.experimental_rerun()
 
+    if st.button("🔎 空き時間を探す"):
+        st.session_state["page"] = "search"
+        st.experimental_rerun()
+
+    if st.button("📦 取込・書出（CSV / ICS）"):
+        st.session_state["page"] = "transfer"
+        st.experimental_rerun()
+
+    if st.button("📊 利用状況の分析"):
+        st.session_state["page"] = "analytics"
+        st.experimental_rerun()
+
 # -------------------------------------------------------------
 # 週間表示（閲覧のみ）
 # -------------------------------------------------------------
@@ -302,8 +579,9 @@ elif st.session_state["page"] == "week_view":
     st.title("📅 週間利用状況")
     # --- 🔄 データ再読み込みボタンをここに追加 ---
     if st.button("🔄 データを再読み込み"):
-        with st.spinner("Google Sheets から最新データを取得中..."):
-            load_reservations_from_gsheet()
+        with st.spinner("最新データを取得中..."):
+            get_snapshot_store().invalidate()
+            refresh_snapshot()
         st.success("✅ 最新データを読み込みました。")
         st.experimental_rerun()
     # --- ここまで追加 ---
@@ -311,60 +589,27 @@ elif st.session_state["page"] == "week_view":
     if not week:
         st.warning("⚠️ 週データが見つかりません。カレンダーから再選択してください。")
         st.stop()
-
-    for d in week:
-        weekday_map = ["月", "火", "水", "木", "金", "土", "日"]
-        w = weekday_map[d.weekday()]
-        col_date, col_btn = st.columns([7, 3])
-        with col_date:
-            st.markdown(f"### 📅 {d.strftime('%Y-%m-%d')}（{w}）")
-        with col_btn:
-            st.markdown("<div style='height:3px'></div>", unsafe_allow_html=True)
-            if st.button("🔍 この日の予約を見る", key=f"btn_{d}"):
-                st.session_state["selected_date"] = d
-                st.session_state["page"] = "day_view"
-                st.experimental_rerun()
-
-        # 週用の簡易インジケータ（空満）
-        for idx, layer in enumerate(["前側", "奥側"]):
-            label = ["前側", "奥側",][idx]
-            row = [
-                f"<div style='width:60px;text-align:center;font-weight:600;font-size:14px;border:1px solid #999;background:#f9f9f9;'>{label}</div>"
-            ]
-            for slot in TIME_SLOTS:
-                s0 = parse_time(slot)
-                e0 = (datetime.combine(datetime.today(), s0) + timedelta(minutes=30)).time()
-                color, text = "#ffffff", ""
-                if layer in ["前側", "奥側"]:
-                    active = any(
-                        r["status"] == "active"
-                        and str(r["date"]) == str(d)
-                        and overlap(parse_time(r["start"]), parse_time(r["end"]), s0, e0)
-                        for r in st.session_state["reservations"][layer]
-                    )
-                    color = "#ffcccc" if active else "#ccffcc"
-                    text = f"<span style='font-size:14px;font-weight:500;'>{slot}</span>"
-                else:
-                    # ← ここは d（日付）を使う
-                    front_busy = any(
-                        r["status"] == "active"
-                        and str(r["date"]) == str(d)
-                        and overlap(parse_time(r["start"]), parse_time(r["end"]), s0, e0)
-                        for r in st.session_state["reservations"]["前側"]
-                    )
-                    back_busy = any(
-                        r["status"] == "active"
-                        and str(r["date"]) == str(d)
-                        and overlap(parse_time(r["start"]), parse_time(r["end"]), s0, e0)
-                        for r in st.session_state["reservations"]["奥側"]
-                    )
-                    if front_busy and back_busy:
-                        color = "#ff3333"
-                        text = "<b><span style='color:white;font-size:15px;'>満</span></b>"
-                row.append(
-                    f"<div style='flex:1;background:{color};border:1px solid #aaa;text-align:center;padding:4px;'>{text}</div>"
-                )
-            st.markdown(f"<div style='display:flex;'>{''.join(row)}</div>", unsafe_allow_html=True)
+    ensure_loaded(week[0], week[-1])
+    watch_changes()
+
+    # 部屋が多いときは表示する部屋を絞れる
+    group_names = [g for g, _, _ in get_room_layout().groups]
+    shown = None
+    if len(group_names) > 1:
+        shown = st.multiselect("表示する部屋", group_names, default=group_names, key="week_groups")
+
+    # 1週間分を1つの HTML として描画（週の占有マスクが同じならキャッシュから返る）
+    render_grid(week, titled=True, groups=shown)
+
+    # 日別表示への移動は日付の選択欄とボタン1つにまとめる
+    col_date, col_btn = st.columns([7, 3])
+    with col_date:
+        picked = st.selectbox("日付", week, format_func=day_title, label_visibility="collapsed")
+    with col_btn:
+        if st.button("🔍 この日の予約を見る"):
+            st.session_state["selected_date"] = picked
+            st.session_state["page"] = "day_view"
+            st.experimental_rerun()
 
     st.markdown("---")
    # --- 週移動ボタン ---
@@ -391,92 +636,282 @@ elif st.session_state["page"] == "week_view":
                 st.session_state["selected_week"] = [new_start + timedelta(days=i) for i in range(7)]
                 st.experimental_rerun()
 
+# -------------------------------------------------------------
+# 空き時間検索
+# -------------------------------------------------------------
+elif st.session_state["page"] == "search":
+    st.title("🔎 空き時間検索")
+
+    c1, c2, c3, c4 = st.columns(4)
+    layout = get_room_layout()
+    # 既定は最初の「合わせて使う区画」（全面）
+    room = c1.selectbox("区画", layout.rooms,
+                        index=next((i for i, r in enumerate(layout.rooms) if layout.is_composite(r)), 0))
+    duration = c2.selectbox("利用時間", [SLOT_MINUTES * k for k in range(1, len(TIME_SLOTS) + 1)], index=3,
+                            format_func=lambda m: f"{m // 60}時間" if m % 60 == 0 else f"{m}分")
+    win_start = c3.selectbox("時間帯（から）", SLOT_STARTS, index=SLOT_STARTS.index(to_minutes("13:00")),
+                             format_func=fmt_minutes)
+    win_end = c4.selectbox("時間帯（まで）", SLOT_ENDS, index=len(SLOT_ENDS) - 1, format_func=fmt_minutes)
+    c5, c6, c7 = st.columns([2, 1, 1])
+    weekdays = c5.multiselect("曜日", list(range(7)), default=list(range(5)), format_func=WEEKDAYS.__getitem__)
+    weeks = c6.number_input("検索期間（週）", min_value=1, max_value=52, value=8)
+    limit = c7.number_input("表示件数", min_value=1, max_value=50, value=10)
+
+    today, now = datetime.now().date(), datetime.now()
+    if win_end - win_start < duration:
+        st.warning("⚠️ 時間帯が利用時間より短くなっています。")
+        slots = []
+    else:
+        ensure_loaded(today, today + timedelta(days=7 * weeks - 1))
+        slots = find_free_slots(st.session_state["snapshot"], layout.masks[room], duration, (win_start, win_end),
+                                set(weekdays), today.toordinal(), 7 * weeks, limit,
+                                not_before=(today.toordinal(), now.hour * 60 + now.minute))
+
+    if slots:
+        import pandas as pd
+        st.dataframe(pd.DataFrame([
+            {"日付": day_title(datetime.fromordinal(day).date()), "時間": f"{fmt_minutes(s)}〜{fmt_minutes(e)}"}
+            for day, s, e in slots
+        ]), use_container_width=True, hide_index=True)
+        col_date, col_btn = st.columns([7, 3])
+        with col_date:
+            picked = st.selectbox("日付", sorted({datetime.fromordinal(day).date() for day, _, _ in slots}),
+                                  format_func=day_title, label_visibility="collapsed")
+        with col_btn:
+            if st.button("📝 この日の予約画面へ"):
+                st.session_state["selected_date"] = picked
+                st.session_state["page"] = "day_view"
+                st.experimental_rerun()
+    elif win_end - win_start >= duration:
+        st.info("条件に合う空き時間は見つかりませんでした。")
+
+    if st.button("📅 カレンダーに戻る"):
+        st.session_state["page"] = "calendar"
+        st.experimental_rerun()
+
+# -------------------------------------------------------------
+# 取込・書出（CSV / ICS）
+# -------------------------------------------------------------
+elif st.session_state["page"] == "transfer":
+    import pandas as pd
+    from transfer import csv_chunks, ics_chunks, read_csv
+
+    st.title("📦 予約データの取込・書出")
+    st.caption("列は シートと同じ 区画／日付／開始／終了／担当者／目的／内線／状態／取消日。"
+               "《全面》は1行（旧形式の前側・奥側2行＋担当者(全面)も取込時に1行へまとめます）。")
+
+    # --- 書出 ---
+    st.subheader("📤 書出")
+    today = datetime.now().date()
+    c1, c2, c3 = st.columns([1, 1, 1])
+    exp_from = c1.date_input("開始日", today - timedelta(days=today.weekday()))
+    exp_to = c2.date_input("終了日", today + timedelta(weeks=4), min_value=exp_from)
+    exp_format = c3.selectbox("形式", ["CSV", "ICS"])
+    if st.button("書出ファイルを作成"):
+        rows = get_storage().iter_range(exp_from.isoformat(), (exp_to + timedelta(days=1)).isoformat())
+        # 保存先のカーソルから1行ずつ書式化する（DataFrame は作らない）
+        if exp_format == "CSV":
+            data = "".join(csv_chunks(rows)).encode("utf-8-sig")
+        else:
+            data = "".join(ics_chunks(rows)).encode("utf-8")
+        st.session_state["export"] = (f"reservations_{exp_from}_{exp_to}.{exp_format.lower()}", data)
+    if st.session_state.get("export"):
+        name, data = st.session_state["export"]
+        # ダウンロードしたらセッションから消す（書出の中身をセッションに持ち続けない）
+        st.download_button(f"⬇ {name} をダウンロード", data, file_name=name,
+                           mime="text/csv" if name.endswith(".csv") else "text/calendar",
+                           on_click=lambda: st.session_state.pop("export", None))
+
+    # --- 取込 ---
+    st.divider()
+    st.subheader("📥 取込")
+    c1, c2 = st.columns([3, 1])
+    upload = c1.file_uploader("CSVファイル", type=["csv"])
+    encoding = c2.selectbox("文字コード", ["utf-8-sig", "cp932"], format_func=lambda e: "UTF-8" if e == "utf-8-sig" else "Shift_JIS")
+
+    def scan_upload():
+        upload.seek(0)
+        stream = io.TextIOWrapper(upload, encoding=encoding, newline="")
+        try:
+            return validate_import(read_csv(stream))
+        finally:
+            stream.detach()
+
+    if upload is not None:
+        try:
+            accepted, errors = scan_upload()
+        except (ValueError, UnicodeDecodeError) as e:
+            st.error(f"ファイルを読めませんでした: {e}")
+            accepted, errors = [], []
+        st.markdown(f"取込できる行：**{len(accepted)}件**　／　取込できない行：**{len(errors)}件**")
+        if errors:
+            st.dataframe(pd.DataFrame(errors, columns=["行", "理由"]), use_container_width=True, hide_index=True)
+        if accepted and st.button(f"{len(accepted)}件を取り込む"):
+            # 確定時にもう一度1回で検証し（他の登録と競合していないか）、まとめて1回で保存する
+            accepted, errors = scan_upload()
+            try:
+                with get_metrics().span("save"):
+                    ids, rejected = get_storage().insert_checked(
+                        accepted, partial(row_conflicts, layout=get_room_layout()))
+            except Exception as e:
+                st.error(f"予約データの保存に失敗しました: {e}")
+            else:
+                get_snapshot_store().invalidate()
+                st.success(f"✅ {len(ids)}件を取り込みました。")
+                if rejected:
+                    st.warning(f"確定の直前に登録された予約と重なったため、{len(rejected)}件は取り込みませんでした。")
+
+    if st.button("📅 カレンダーに戻る"):
+        st.session_state["page"] = "calendar"
+        st.experimental_rerun()
+
+# -------------------------------------------------------------
+# 利用状況の分析（稼働率・取消率。予約・取消のたびに更新済みの集計表から）
+# -------------------------------------------------------------
+elif st.session_state["page"] == "analytics":
+    from analytics import months_of, occupancy_report, usage_frames
+    st.title("📊 利用状況の分析")
+    st.caption("稼働率＝使用時間 ÷ 開室時間（" + f"{TIME_SLOTS[0]}〜{fmt_minutes(SLOT_ENDS[-1])}）。"
+               "全面など複数の部屋を使う予約は、それぞれの部屋に数えます。"
+               "取消率＝取消件数 ÷ 予約件数（月は利用日の月）。")
+
+    layout = get_room_layout()
+    with get_metrics().span("analytics"):
+        minutes, bookings = usage_frames(get_storage().usage_totals(), layout)
+    months = months_of(minutes, bookings)
+    if not months:
+        st.info("集計できる予約がまだありません。")
+    else:
+        # 既定は今月までの直近12か月
+        this_month = datetime.now().strftime("%Y-%m")
+        last_default = months.index(max([m for m in months if m <= this_month], default=months[-1]))
+        c1, c2 = st.columns(2)
+        first = c1.selectbox("開始月", months, index=max(0, last_default - 11))
+        later = [m for m in months if m >= first]
+        last = c2.selectbox("終了月", later, index=later.index(months[last_default]) if months[last_default] in later
+                            else len(later) - 1)
+        report = occupancy_report(minutes, bookings, layout, first, last)
+
+        st.subheader("📅 月別の稼働率（%）")
+        st.line_chart(report["month"])
+        st.dataframe(report["month"], use_container_width=True)
+
+        st.subheader("🗓 曜日別の稼働率（%）")
+        st.dataframe(report["weekday"], use_container_width=True)
+
+        st.subheader("🕘 時間帯別の稼働率（%）")
+        st.line_chart(report["slot"]["全体"])
+        st.dataframe(report["slot"], use_container_width=True)
+
+        st.subheader("🗑️ 月別の取消率")
+        st.dataframe(report["cancel"], use_container_width=True)
+
+    if st.button("📅 カレンダーに戻る"):
+        st.session_state["page"] = "calendar"
+        st.experimental_rerun()
+
+# -------------------------------------------------------------
+# 診断（区間ごとの所要時間・キャッシュ・Sheets 呼び出し）
+# -------------------------------------------------------------
+elif st.session_state["page"] == "diagnostics":
+    st.title("🩺 診断")
+    diag_cfg = _secrets_section("diagnostics") or {}
+
+    if not diag_cfg.get("password"):
+        st.info("診断ページのパスワードが設定されていません（secrets の [diagnostics] password）。")
+    elif not st.session_state.get("diag_authenticated"):
+        pw = st.text_input("診断用パスワード", type="password")
+        if st.button("表示"):
+            if pw == diag_cfg["password"]:
+                st.session_state["diag_authenticated"] = True
+                st.experimental_rerun()
+            else:
+                st.error("パスワードが違います。")
+    else:
+        import pandas as pd
+        data = get_metrics().to_dict()
+        counters = data["counters"]
+        snap_total = sum(counters.get(k, 0) for k in ("snapshot.hit", "snapshot.poll", "snapshot.delta", "snapshot.full"))
+        snap_reuse = snap_total - counters.get("snapshot.delta", 0) - counters.get("snapshot.full", 0)
+        grid_total = counters.get("grid.requests", 0)
+        c1, c2, c3, c4 = st.columns(4)
+        c1.metric("接続中のセッション", data["sessions"])
+        c2.metric("再実行回数", counters.get("reruns", 0))
+        c3.metric("スナップショット再利用率", f"{snap_reuse / snap_total:.0%}" if snap_total else "-")
+        c4.metric("インジケータ HTML キャッシュ命中率",
+                  f"{1 - counters.get('grid.misses', 0) / grid_total:.0%}" if grid_total else "-")
+
+        st.subheader("🚀 起動時（プロセスで最初の1回）")
+        st.caption("first_login_render＝最初のログイン画面の描画、storage_open＝保存先の接続（Sheets ミラーの初回読込を含む）、"
+                   "snapshot_load＝予約の初回読込、warm_up_total＝その合計（ログイン画面の裏で実行）")
+        if data["startup_ms"]:
+            st.dataframe(pd.DataFrame([{"区間": k, "ms": v} for k, v in data["startup_ms"].items()]),
+                         use_container_width=True, hide_index=True)
+
+        st.subheader("⏱ 区間ごとの所要時間")
+        st.caption("load＝予約の参照・読込、load.read / index.build / load.delta＝その内訳、"
+                   "bitmap＝占有マスクとインジケータ、render.＊＝ページ描画（render.login＝ログイン画面）、"
+                   "save＝保存、rerun＝再実行全体")
+        if data["spans"]:
+            st.dataframe(pd.DataFrame([{"区間": name, **h} for name, h in data["spans"].items()]),
+                         use_container_width=True, hide_index=True)
+
+        st.subheader("📡 Google Sheets")
+        storage = get_storage()
+        if isinstance(storage, MirroredStorage) and hasattr(storage.mirror, "pool"):
+            sheets = storage.mirror.pool.scheduler.report()
+            st.dataframe(pd.DataFrame([{"操作": op, **v} for op, v in sorted(sheets["ops"].items())]),
+                         use_container_width=True, hide_index=True)
+            latency = sheets["latency"]
+            st.caption(f"呼び出し {latency['count']}回　平均 {latency['mean_ms']}ms　p50 ≤{latency['p50_ms']}ms　"
+                       f"p95 ≤{latency['p95_ms']}ms　最大 {latency['max_ms']}ms")
+            st.bar_chart(pd.Series(latency["buckets"], name="回数"))
+            count, age, error = storage.sync_status()
+            st.caption(f"スケジューラ：{sheets['stats']}　／　反映待ち {count}件（最古 {age:.0f}秒）{error}")
+        else:
+            st.caption("Google Sheets ミラーは使っていません（SQLite のみ）。")
+
+        with st.expander("JSON"):
+            st.json(data)
+
+    if st.button("📅 カレンダーに戻る"):
+        st.session_state["page"] = "calendar"
+        st.experimental_rerun()
+
 # -------------------------------------------------------------
 # 日別表示（詳細）
 # -------------------------------------------------------------
 elif st.session_state["page"] == "day_view":
     date = st.session_state["selected_date"]
-    weekday_map = ["月", "火", "水", "木", "金", "土", "日"]
-    w = weekday_map[date.weekday()]
-    st.markdown(f"## 📅 {date}（{w}）の利用状況")
+    ensure_loaded(date, date)
+    watch_changes()
+    st.markdown(f"## 📅 {day_title(date)}の利用状況")
 
-    # --- インジケータ（赤：使用中／緑：空き／満：両室占有） ---
+    # --- インジケータ（赤：使用中／緑：空き／満：部屋全体が占有） ---
     st.markdown("### 🏢 会議室 利用状況")
-    for idx, layer in enumerate(["前側", "奥側", "空満"]):
-        label = ["前側", "奥側", "空満"][idx]
-        row = [
-            f"<div style='width:60px;text-align:center;font-weight:600;font-size:14px;border:1px solid #999;background:#f9f9f9;'>{label}</div>"
-        ]
-        for slot in TIME_SLOTS:
-            s0 = parse_time(slot)
-            e0 = (datetime.combine(datetime.today(), s0) + timedelta(minutes=30)).time()
-            color, text = "#ffffff", ""
-            if layer in ["前側", "奥側"]:
-                active = any(
-                    r["status"] == "active"
-                    and str(r["date"]) == str(date)
-                    and overlap(parse_time(r["start"]), parse_time(r["end"]), s0, e0)
-                    for r in st.session_state["reservations"][layer]
-                )
-                color = "#ffcccc" if active else "#ccffcc"
-                text = f"<span style='font-size:14px;font-weight:500;'>{slot}</span>"
-            else:
-                front_busy = any(
-                    r["status"] == "active"
-                    and str(r["date"]) == str(date)
-                    and overlap(parse_time(r["start"]), parse_time(r["end"]), s0, e0)
-                    for r in st.session_state["reservations"]["前側"]
-                )
-                back_busy = any(
-                    r["status"] == "active"
-                    and str(r["date"]) == str(date)
-                    and overlap(parse_time(r["start"]), parse_time(r["end"]), s0, e0)
-                    for r in st.session_state["reservations"]["奥側"]
-                )
-                if front_busy and back_busy:
-                    color = "#ff3333"
-                    text = "<b><span style='color:white;font-size:15px;'>満</span></b>"
-            row.append(
-                f"<div style='flex:1;background:{color};border:1px solid #aaa;text-align:center;padding:4px;'>{text}</div>"
-            )
-        st.markdown(f"<div style='display:flex;'>{''.join(row)}</div>", unsafe_allow_html=True)
+    render_grid([date], with_full=True)
 
     # （この下の「一覧表／登録／取消／戻る」ロジックは現行のまま）
 
     # --- 一覧表（全面統合表示） ---
     st.divider()
     st.markdown("### 📋 使用状況一覧（時間順）")
-    all_recs = []
-    for room, items in st.session_state["reservations"].items():
-        for r in items:
-            if str(r["date"]) == str(date):
-                all_recs.append({
-                    "区画": room,
-                    "時間": f"{r['start']}〜{r['end']}",
-                    "担当者": r["user"].replace("(全面)", ""),   # ← この1行だけ変更
-                    "目的": r["purpose"],
-                    "内線": r["ext"],
-                    "状態": "取消" if r["status"] == "cancel" else "有効",
-                    "取消日": r["cancel"]
-                })
-
-    # 前側+奥側の同一（担当者/時間/状態）を全面へ統合表示
-    merged = []
-    seen = set()
-    for i, r1 in enumerate(all_recs):
-        if i in seen:
-            continue
-        same = [r for r in all_recs if r["担当者"] == r1["担当者"]
-                and r["時間"] == r1["時間"]
-                and r["状態"] == r1["状態"]
-                and r["区画"] in ["前側", "奥側"]]
-        if len(same) == 2:
-            merged.append({**r1, "区画": "全面"})
-            seen.update([all_recs.index(x) for x in same])
-        else:
-            merged.append(r1)
+    # 全面は1件のレコードなので、そのまま1行で表示できる
+    merged = [
+        {
+            "区画": r.room,
+            "時間": f"{fmt_minutes(r.start)}〜{fmt_minutes(r.end)}",
+            "担当者": r.user,
+            "目的": r.purpose,
+            "内線": r.ext,
+            "状態": "取消" if r.status == "cancel" else "有効",
+            "取消日": r.cancel
+        }
+        for r in st.session_state["snapshot"].on_date(date.toordinal())
+    ]
 
     if merged:
+        import pandas as pd
         df = pd.DataFrame(merged).sort_values(by="時間")
         st.dataframe(df, use_container_width=True, hide_index=True)
     else:
@@ -487,31 +922,52 @@ elif st.session_state["page"] == "day_view":
     st.subheader("📝 新しい予約を登録")
 
     c1, c2, c3, c4, c5, c6 = st.columns([1, 1, 1, 1, 2, 1])
-    room = c1.selectbox("区画", ROOMS)
-    start = c2.selectbox("開始", TIME_SLOTS)
-    end = c3.selectbox("終了", TIME_SLOTS)
+    room = c1.selectbox("区画", get_room_layout().rooms)
+    start = c2.selectbox("開始", SLOT_STARTS, format_func=fmt_minutes)
+    end = c3.selectbox("終了", SLOT_STARTS, format_func=fmt_minutes)
     user = c4.text_input("担当者")
     purpose = c5.text_input("目的（任意）")
     ext = c6.text_input("内線（任意）")
 
+    # 繰り返し予約：この日から終了日まで毎週／隔週（除外日を除く）
+    if st.checkbox("🔁 繰り返し予約（毎週・隔週）"):
+        r1, r2, r3 = st.columns([1, 1, 3])
+        every = r1.selectbox("頻度", [1, 2], format_func=lambda n: "毎週" if n == 1 else "隔週")
+        until = r2.date_input("終了日", date + timedelta(weeks=12), min_value=date)
+        excluded = r3.multiselect("除外日", recurrence_dates(date, until, every)[1:], format_func=day_title)
+        dates = recurrence_dates(date, until, every, excluded)
+    else:
+        dates = [date]
+
     st.markdown("<div style='height:8px'></div>", unsafe_allow_html=True)
     btn_center = st.columns([1, 1, 1])[1]
     with btn_center:
         if st.button("登録", use_container_width=True):
             if not user:
                 st.error("担当者名を入力してください。")
-            elif parse_time(end) <= parse_time(start):
+            elif end <= start:
                 st.error("終了時刻は開始より後にしてください。")
-            elif has_conflict(room, date, start, end):
-                st.warning("⚠️ この時間帯はすでに予約されています。")
             else:
-                st.session_state["pending_register"] = {"room": room, "date": date, "start": start, "end": end,
-                                                         "user": user, "purpose": purpose, "ext": ext}
+                # 全回分の衝突をまとめて判定し、衝突する日は確認画面で知らせて除く
+                ensure_loaded(dates[0], dates[-1])
+                ok, clash = split_conflicts(room, dates, start, end)
+                if not ok:
+                    st.warning("⚠️ この時間帯はすでに予約されています。")
+                else:
+                    st.session_state["pending_register"] = {"room": room, "dates": ok, "start": start, "end": end,
+                                                             "user": user, "purpose": purpose, "ext": ext,
+                                                             "clash": clash}
 
     if st.session_state["pending_register"]:
-        d = st.session_state["pending_register"]
+        d = dict(st.session_state["pending_register"])
+        clash = d.pop("clash", [])
+        series = ""
+        if len(d["dates"]) > 1:
+            series = f"<br>{len(d['dates'])}回：{day_title(d['dates'][0])}〜{day_title(d['dates'][-1])}"
+        if clash:
+            series += "<br>⚠️ 既存の予約と重なるため除く日：" + "、".join(day_title(c) for c in clash)
         st.markdown(f"<div style='border:2px solid #666;padding:10px;background:#f0f0f0;text-align:center;'>"
-                    f"<b>登録内容確認：</b><br>{d['room']}　{d['start']}〜{d['end']}　{d['user']}<br>これで登録しますか？</div>", unsafe_allow_html=True)
+                    f"<b>登録内容確認：</b><br>{d['room']}　{fmt_minutes(d['start'])}〜{fmt_minutes(d['end'])}　{d['user']}{series}<br>これで登録しますか？</div>", unsafe_allow_html=True)
         c1, c2, c3 = st.columns([1, 1, 1])
         with c2:
             b1, b2 = st.columns([1, 1])
@@ -526,41 +982,19 @@ elif st.session_state["page"] == "day_view":
     st.divider()
     st.subheader("🗑️ 予約取消")
 
-    # まず、前側/奥側のペアを検出（キー：担当者・時間）
-    pairs_set = set()
-    for r in st.session_state["reservations"]["前側"]:
-        for s in st.session_state["reservations"]["奥側"]:
-            if (r["user"] == s["user"]
-                and r["start"] == s["start"]
-                and r["end"] == s["end"]
-                and str(r["date"]) == str(s["date"])
-                and r["status"] == "active"
-                and s["status"] == "active"):
-                pairs_set.add((r["user"], r["start"], r["end"], str(r["date"])))
-
-    # 取消候補を重複なく構築。ペアがある場合は《全面》のみ出す
-    cancels = []
-    seen_keys = set()
-    for room_name, items in st.session_state["reservations"].items():
-        for r in items:
-            if str(r["date"]) == str(date) and r["status"] == "active":
-                key = (r["user"], r["start"], r["end"], str(r["date"]))
-                if key in seen_keys:
-                    continue
-                if key in pairs_set:
-                    cancels.append(f"全面 | {r['user'].replace('(全面)', '')} | {r['start']}〜{r['end']}")
-                else:
-                    cancels.append(f"{room_name} | {r['user'].replace('(全面)', '')} | {r['start']}〜{r['end']}")
-
-                seen_keys.add(key)
+    # 取消候補は当日の有効な予約（全面も1件）を id で並べる
+    cancels = {
+        r.id: f"{r.room} | {r.user} | {fmt_minutes(r.start)}〜{fmt_minutes(r.end)}"
+        for r in sorted(st.session_state["snapshot"].on_date(date.toordinal()), key=lambda r: r.start)
+        if r.status == "active"
+    }
 
     if cancels:
-        sel = st.selectbox("取消対象を選択", cancels, key=f"cancel_sel_{date}")
+        sel = st.selectbox("取消対象を選択", list(cancels), format_func=cancels.get, key=f"cancel_sel_{date}")
         if st.button("取消"):
-            room_sel, user_sel, t = sel.split(" | ")
-            start_sel, end_sel = t.split("〜")
+            r = st.session_state["snapshot"].by_id[sel]
             st.session_state["pending_cancel"] = {
-                "room": room_sel, "user": user_sel, "start": start_sel, "end": end_sel, "date": date
+                "id": sel, "room": r.room, "user": r.user, "start": fmt_minutes(r.start), "end": fmt_minutes(r.end)
             }
 
     if st.session_state["pending_cancel"]:
@@ -572,23 +1006,7 @@ elif st.session_state["page"] == "day_view":
             b1, b2 = st.columns([1, 1])
             with b1:
                 if st.button("はい、取消する"):
-                    if d["room"] == "全面":
-                        # 両室とも該当をcancel
-                        for sub in ["前側", "奥側"]:
-                            for r in st.session_state["reservations"][sub]:
-                                if ((r["user"] == d["user"]) or (r["user"] == f"{d['user']}(全面)") or (d["user"] in r["user"])) \
-                                    and r["start"] == d["start"] \
-                                    and r["end"] == d["end"] \
-                                    and str(r["date"]) == str(d["date"]) \
-                                    and r["status"] == "active":
-                                    r["status"] = "cancel"
-                                    r["cancel"] = datetime.now().strftime("%Y-%m-%d")
-                        save_reservations_to_gsheet()
-                        st.success("🗑️ 全面予約を取り消しました。")
-                        st.session_state["pending_cancel"] = None
-                        st.experimental_rerun()
-                    else:
-                        cancel_reservation(**d)
+                    cancel_reservation(d["id"])
             with b2:
                 if st.button("戻る"):
                     st.session_state["pending_cancel"] = None
@@ -599,25 +1017,8 @@ elif st.session_state["page"] == "day_view":
 
     st.caption("中央大学生活協同組合　情報通信チーム（Ver.Oct.2025）")
 
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+# -------------------------------------------------------------
+# 計測：最後まで描画できた再実行だけを記録する
+# -------------------------------------------------------------
+get_metrics().record(f"render.{st.session_state['page']}", time.perf_counter() - render_started)
+get_metrics().end_run()
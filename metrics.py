@@ -0,0 +1,158 @@
+# =========================================================
+# 計測（診断ページ・構造化ログ用）
+# - Histogram   : 所要時間の度数分布（固定境界、ミリ秒）
+# - payload_size: Sheets とやり取りする値のおおよそのバイト数
+# - Metrics     : 再実行（rerun）ごとの区間計測、カウンタ、セッション数、起動時の所要時間
+# Streamlit には依存しない
+# =========================================================
+
+import bisect
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+
+log = logging.getLogger(__name__)
+
+BOUNDS_MS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000)
+
+
+class Histogram:
+    """所要時間（秒で受け取り、ミリ秒の境界 BOUNDS_MS で数える）。ロックは呼び出し側で持つ"""
+
+    def __init__(self):
+        self.counts = [0] * (len(BOUNDS_MS) + 1)
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def add(self, seconds):
+        ms = seconds * 1000
+        self.counts[bisect.bisect_left(BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total += ms
+        self.max = max(self.max, ms)
+
+    def quantile(self, q):
+        """q 分位点が入る区間の上端（ミリ秒）"""
+        if not self.count:
+            return 0.0
+        need, seen = q * self.count, 0
+        for i, c in enumerate(self.counts):
+            seen += c
+            if seen >= need:
+                return min(float(BOUNDS_MS[i]), self.max) if i < len(BOUNDS_MS) else self.max
+        return self.max
+
+    def buckets(self):
+        labels = [f"≤{b}ms" for b in BOUNDS_MS] + [f">{BOUNDS_MS[-1]}ms"]
+        return dict(zip(labels, self.counts))
+
+    def to_dict(self):
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total / self.count, 2) if self.count else 0.0,
+            "p50_ms": self.quantile(0.5),
+            "p95_ms": self.quantile(0.95),
+            "max_ms": round(self.max, 2),
+        }
+
+
+def payload_size(value):
+    """文字列・数値・入れ子の list / dict の UTF-8 でのおおよそのバイト数"""
+    if value is None:
+        return 0
+    if isinstance(value, str):
+        return len(value.encode("utf-8"))
+    if isinstance(value, (list, tuple)):
+        return sum(payload_size(v) for v in value)
+    if isinstance(value, dict):
+        return sum(payload_size(k) + payload_size(v) for k, v in value.items())
+    return len(str(value))
+
+
+class Metrics:
+    """プロセス全体の計測値。区間（span）は名前ごとのヒストグラムに積み、
+    同じスレッドで実行中の再実行（begin_run〜end_run）の内訳にも足し込む。
+
+    json_logs=True なら再実行ごとに内訳を1行の JSON としてログに出す。
+    起動時の所要時間（プロセスで最初の1回だけの値）は startup に mark_startup で残す。
+    """
+    SESSION_TTL = 300   # この秒数以内に再実行のあったセッションを「接続中」と数える
+
+    def __init__(self, json_logs=False):
+        self.json_logs = json_logs
+        self.spans = {}
+        self.counters = {}
+        self.startup = {}
+        self.created = time.time()
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def begin_run(self, session, page):
+        now = time.time()
+        self._local.run = {"session": session, "page": page, "started": time.perf_counter(), "spans": {}}
+        with self._lock:
+            self._sessions[session] = now
+            self.counters["reruns"] = self.counters.get("reruns", 0) + 1
+
+    def end_run(self):
+        """再実行の最後まで到達したときに呼ぶ（st.stop や再実行要求で中断した回は数えない）"""
+        run = self._local.__dict__.pop("run", None)
+        if run is None:
+            return
+        total = time.perf_counter() - run["started"]
+        self.record("rerun", total)
+        if self.json_logs:
+            log.info(json.dumps({
+                "event": "rerun", "session": run["session"], "page": run["page"],
+                "total_ms": round(total * 1000, 2),
+                "spans_ms": {k: round(v * 1000, 2) for k, v in run["spans"].items()},
+            }, ensure_ascii=False))
+
+    def record(self, name, seconds):
+        with self._lock:
+            self.spans.setdefault(name, Histogram()).add(seconds)
+        run = getattr(self._local, "run", None)
+        if run is not None and name != "rerun":
+            run["spans"][name] = run["spans"].get(name, 0.0) + seconds
+
+    @contextmanager
+    def span(self, name):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - t0)
+
+    def mark_startup(self, name, seconds):
+        """起動時の区間 name の所要時間を記録する（2回目以降は無視）"""
+        with self._lock:
+            if name in self.startup:
+                return
+            self.startup[name] = round(seconds * 1000, 2)
+        if self.json_logs:
+            log.info(json.dumps({"event": "startup", "name": name, "ms": self.startup[name]}, ensure_ascii=False))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + n
+
+    def active_sessions(self):
+        cutoff = time.time() - self.SESSION_TTL
+        with self._lock:
+            for sid in [s for s, seen in self._sessions.items() if seen < cutoff]:
+                del self._sessions[sid]
+            return len(self._sessions)
+
+    def to_dict(self):
+        sessions = self.active_sessions()
+        with self._lock:
+            return {
+                "sessions": sessions,
+                "counters": dict(self.counters),
+                "startup_ms": dict(self.startup),
+                "spans": {name: h.to_dict() for name, h in sorted(self.spans.items())},
+            }
@@ -0,0 +1,412 @@
+# =========================================================
+# 予約データのモデル（Streamlit には依存しない）
+# - 時間枠の定数と分⇔"HH:MM" の変換
+# - RoomLayout          : 部屋の定義（最小単位の部屋ごとに1ビット、区画はその和）
+# - Reservation         : 予約1件（全面も1件）の不変レコード
+# - 日付別インデックス  : index_add / index_remove / index_overlaps
+# - ReservationSnapshot : 全セッションで共有する不変スナップショット
+# - row_conflicts       : 保存先の最新の行に対する衝突判定（確定時の再確認用）
+# - find_free_slots     : 占有マスクからの空き検索
+# - build_grid_html     : 週・日のインジケータ HTML
+# 画面（main.py）とベンチマーク（bench.py）の両方から使う
+# =========================================================
+
+import bisect
+import logging
+from datetime import datetime
+from typing import NamedTuple
+
+log = logging.getLogger(__name__)
+
+
+def to_minutes(tstr):
+    h, m = map(int, str(tstr).split(":"))
+    return h * 60 + m
+
+
+def fmt_minutes(m):
+    return f"{m // 60:02d}:{m % 60:02d}"
+
+
+TIME_SLOTS = [f"{h:02d}:{m:02d}" for h in range(9, 21) for m in (0, 30)]
+SLOT_MINUTES = 30
+# 各枠の開始（0時からの分）。起動時に一度だけ計算し、以降は整数で比較する
+SLOT_STARTS = [to_minutes(t) for t in TIME_SLOTS]
+SLOT_ENDS = [s + SLOT_MINUTES for s in SLOT_STARTS]
+SLOT_ORIGIN = SLOT_STARTS[0]
+
+
+# -------------------------------------------------------------
+# 占有ビットマップ（1ビット = TIME_SLOTS の30分枠1つ）
+# -------------------------------------------------------------
+def interval_mask(s, e):
+    """[s, e)（分）が掛かる枠のビットを立てたマスク"""
+    lo = max(0, (s - SLOT_ORIGIN) // SLOT_MINUTES)
+    hi = min(len(TIME_SLOTS), -((SLOT_ORIGIN - e) // SLOT_MINUTES))
+    return ((1 << (hi - lo)) - 1) << lo if hi > lo else 0
+
+
+# -------------------------------------------------------------
+# 部屋の定義
+# -------------------------------------------------------------
+# 部屋（建物・会議室）ごとに、分けて使える最小単位（parts）と、
+# それらを合わせて使う区画（composites: 区画名 → parts の一部）を並べる。
+# 区画名は保存行の「区画」にそのまま入るので、全体で重複できない。
+DEFAULT_ROOMS = {
+    "会議室": {"parts": ["前側", "奥側"], "composites": {"全面": ["前側", "奥側"]}},
+}
+
+
+class RoomLayout:
+    """部屋の定義。最小単位の部屋（part）ごとに1ビットを割り当て、
+    予約できる区画はそれぞれ part のビットの和（マスク）として持つ。
+
+    - rooms  : 予約できる区画名（部屋ごとに parts → composites の順）
+    - masks  : 区画名 → マスク
+    - parts  : 区画名 → 使う part 名のタプル
+    - groups : [(部屋名, (part 名, ...), 部屋全体のマスク)]（表示用のまとまり）
+    """
+
+    def __init__(self, definitions=None):
+        self.rooms, self.masks, self.parts, self.groups = [], {}, {}, []
+        bit = 0
+        for group, spec in (definitions or DEFAULT_ROOMS).items():
+            parts = tuple(spec.get("parts", ()))
+            if not parts:
+                raise ValueError(f"部屋「{group}」に parts がありません")
+            whole = 0
+            for name in parts:
+                self._add(name, 1 << bit, (name,))
+                whole |= 1 << bit
+                bit += 1
+            for name, members in spec.get("composites", {}).items():
+                unknown = [m for m in members if m not in parts]
+                if unknown or not members:
+                    raise ValueError(f"区画「{name}」の構成が部屋「{group}」の parts にありません: {unknown}")
+                mask = 0
+                for m in members:
+                    mask |= self.masks[m]
+                self._add(name, mask, tuple(members))
+            self.groups.append((group, parts, whole))
+
+    def _add(self, name, mask, parts):
+        if name in self.masks:
+            raise ValueError(f"区画名「{name}」が重複しています")
+        self.rooms.append(name)
+        self.masks[name] = mask
+        self.parts[name] = parts
+
+    def is_composite(self, room):
+        return len(self.parts[room]) > 1
+
+
+# -------------------------------------------------------------
+# 予約レコード
+# -------------------------------------------------------------
+class Reservation(NamedTuple):
+    """予約1件（全面も1件）。タプルなので軽量かつ不変。
+
+    day は date.toordinal()、start/end は0時からの分、mask は使う部屋（RoomLayout のマスク）。
+    読込時に一度だけ変換し、インデックスや画面のループでは整数どうしの比較だけを行う。
+    """
+    id: int
+    room: str
+    mask: int
+    day: int
+    start: int
+    end: int
+    user: str
+    purpose: str
+    ext: str
+    status: str
+    cancel: str
+
+    @property
+    def date(self):
+        return datetime.fromordinal(self.day).date()
+
+    @classmethod
+    def from_row(cls, row, layout):
+        """保存行（文字列）→ レコード。区画が layout になければ KeyError、日付・時刻が読めなければ ValueError"""
+        return cls(
+            row["id"], row["room"], layout.masks[row["room"]],
+            datetime.strptime(row["date"], "%Y-%m-%d").toordinal(),
+            to_minutes(row["start"]), to_minutes(row["end"]),
+            row["user"], row["purpose"], row["ext"],
+            row["status"] or "active", row["cancel"] or "",
+        )
+
+
+# -------------------------------------------------------------
+# 予約インデックス（日付 → 開始順の区間リスト）
+# -------------------------------------------------------------
+# index[day] = (starts, intervals)   day は日付の序数
+#   starts    : 開始分のソート済みリスト（bisect用）
+#   intervals : (開始分, 終了分, レコード) を starts と同じ順で保持
+# 有効（active）な予約のみを載せる。全面も1件で、使う部屋はレコードの mask で判定する。
+def index_add(index, r):
+    """有効な予約1件を、その日のリストへ挿入（開始順を維持）"""
+    if r.status != "active":
+        return
+    starts, intervals = index.setdefault(r.day, ([], []))
+    i = bisect.bisect_right(starts, r.start)
+    starts.insert(i, r.start)
+    intervals.insert(i, (r.start, r.end, r))
+
+
+def index_remove(index, r):
+    """予約1件（同一オブジェクト）をその日のリストから除去"""
+    bucket = index.get(r.day)
+    if not bucket:
+        return
+    starts, intervals = bucket
+    for i, (_, _, rec) in enumerate(intervals):
+        if rec is r:
+            del starts[i]
+            del intervals[i]
+            break
+
+
+def index_overlaps(index, mask, day, s, e):
+    """指定日に、mask の部屋のどれかを使い [s, e) と重なる有効予約があるか"""
+    bucket = index.get(day)
+    if not bucket:
+        return False
+    starts, intervals = bucket
+    # 開始が e 未満の区間だけが候補。そのうち終了が s より後で、部屋が重なれば衝突
+    hi = bisect.bisect_left(starts, e)
+    return any(end > s and r.mask & mask for _, end, r in intervals[:hi])
+
+
+# -------------------------------------------------------------
+# 共有スナップショット（全セッションが同じオブジェクトを参照）
+# -------------------------------------------------------------
+class ReservationSnapshot:
+    """予約データの不変スナップショット。
+
+    予約1件は1レコード（全面も1件、mask に使う部屋を持つ）で、id で引ける。
+    部屋はすべてマスクで受け取るので、区画名や部屋数には依存しない。
+    日付はすべて序数（day）で持つ。更新は with_added / with_cancelled / with_changes が
+    変更日の分だけをコピーした新しいスナップショットを返す（レコードは id で差し替える）。
+    window は読込済みの日付範囲 [lo, hi)（序数）で、範囲外の日は未読込。
+    revision は反映済みの保存先の版番号。
+    """
+
+    def __init__(self, version, by_id, window=(0, 0), by_date=None, index=None, revision=0):
+        self.version = version
+        self.by_id = by_id
+        self.window = window
+        self.revision = revision
+        if by_date is None:
+            by_date, index = {}, {}
+            for r in by_id.values():
+                by_date.setdefault(r.day, []).append(r)
+                index_add(index, r)
+        self.by_date = by_date
+        self.index = index
+        self._slots = {}
+        self._occupancy = {}
+
+    def covers(self, lo, hi):
+        return self.window[0] <= lo and hi <= self.window[1]
+
+    def slot_masks(self, day):
+        """その日の枠ごとの使用中の部屋（マスク）のリスト。スナップショットごとに一度だけ計算"""
+        slots = self._slots.get(day)
+        if slots is None:
+            slots = [0] * len(TIME_SLOTS)
+            for s, e, r in self.index.get(day, ((), ()))[1]:
+                bits = interval_mask(s, e)
+                while bits:
+                    slots[(bits & -bits).bit_length() - 1] |= r.mask
+                    bits &= bits - 1
+            self._slots[day] = slots
+        return slots
+
+    def conflicts(self, mask, day, start, end):
+        """mask の部屋のどれかで [start, end) と重なる有効予約があるか"""
+        # 枠ごとのマスクで重なりがなければ衝突なし（部屋数によらず枠数分の AND だけ）。
+        # 枠の途中で終わる予約もあるので、重なりがあるときは区間で確かめる
+        slots = self.slot_masks(day)
+        bits = interval_mask(start, end)
+        while bits:
+            i = (bits & -bits).bit_length() - 1
+            if slots[i] & mask:
+                return index_overlaps(self.index, mask, day, start, end)
+            bits &= bits - 1
+        return False
+
+    def on_date(self, day):
+        """その日の全予約（取消含む）"""
+        return self.by_date.get(day, ())
+
+    def occupancy_mask(self, day, mask, every=False):
+        """mask の部屋のどれかが使われている枠のマスク（every=True なら全部が使われている枠）"""
+        key = (day, mask, every)
+        out = self._occupancy.get(key)
+        if out is None:
+            out = 0
+            for i, used in enumerate(self.slot_masks(day)):
+                if (used & mask == mask) if every else (used & mask):
+                    out |= 1 << i
+            self._occupancy[key] = out
+        return out
+
+    def _copy_days(self, dates):
+        """変更する日の一覧・バケットだけを複製する（他の日は共有）"""
+        by_date, index = dict(self.by_date), dict(self.index)
+        for d in dates:
+            by_date[d] = list(self.by_date.get(d, ()))
+            starts, intervals = self.index.get(d, ((), ()))
+            index[d] = (list(starts), list(intervals))
+        return by_date, index
+
+    def with_added(self, version, added, window=None):
+        """added: [レコード] を加えた新しいスナップショット（window 指定時は読込範囲も広げる）
+
+        同じ id のレコードが既にあれば差し替える（差分の読込と自分の書込みが重なっても二重にならない）。
+        """
+        return self._replaced(version, added, window or self.window, self.revision)
+
+    def with_cancelled(self, version, cancelled):
+        """cancelled: [取消後レコード] で同じ id のレコードを差し替えた新しいスナップショット"""
+        return self._replaced(version, cancelled, self.window, self.revision)
+
+    def with_changes(self, version, changed, revision):
+        """保存先で変わったレコード（新しい内容）を差し替えた、版番号 revision のスナップショット
+
+        読込範囲外の日の新規予約は取り込まない（その週を表示するときに読まれる）。
+        """
+        lo, hi = self.window
+        changed = [r for r in changed if r.id in self.by_id or lo <= r.day < hi]
+        return self._replaced(version, changed, self.window, revision)
+
+    def _replaced(self, version, records, window, revision):
+        """records を id で差し替え・追加した新しいスナップショット（同じ id は1件だけ残る）"""
+        records = list({r.id: r for r in records}.values())
+        olds = [self.by_id[r.id] for r in records if r.id in self.by_id]
+        by_date, index = self._copy_days({r.day for r in records} | {old.day for old in olds})
+        by_id = dict(self.by_id)
+        for old in olds:
+            items = by_date[old.day]
+            del items[next(i for i, r in enumerate(items) if r.id == old.id)]
+            index_remove(index, old)
+        for r in records:
+            by_id[r.id] = r
+            by_date[r.day].append(r)
+            index_add(index, r)
+        return ReservationSnapshot(version, by_id, window, by_date, index, revision)
+
+EMPTY_SNAPSHOT = ReservationSnapshot(0, {})
+
+
+def to_records(rows, layout):
+    """保存行 → {id: Reservation}。区画が layout にない行、日付・時刻が読めない行は読み飛ばす"""
+    by_id = {}
+    for row in rows:
+        if row["room"] not in layout.masks:
+            continue
+        try:
+            by_id[row["id"]] = Reservation.from_row(row, layout)
+        except ValueError:
+            log.warning("日付・時刻が読めない予約を読み飛ばしました: %s", row)
+    return by_id
+
+
+def row_conflicts(row, existing, layout):
+    """保存行 row（有効なもの）が existing（同じ日の有効な保存行）のどれかと部屋・時間で重なるか
+
+    保存先の最新の行に対して確かめるための関数（storage の insert_checked に渡す）。
+    区画・時刻が読めない行は、重なりを判定できないので衝突として扱う。
+    """
+    if row["status"] != "active":
+        return False
+    try:
+        mask, start, end = layout.masks[row["room"]], to_minutes(row["start"]), to_minutes(row["end"])
+    except (KeyError, ValueError):
+        return True
+    for other in existing:
+        other_mask = layout.masks.get(other["room"], 0)
+        if other_mask & mask and to_minutes(other["start"]) < end and to_minutes(other["end"]) > start:
+            return True
+    return False
+
+
+# -------------------------------------------------------------
+# 空き検索
+# -------------------------------------------------------------
+def find_free_slots(snap, mask, duration, window, weekdays, first, days, limit=10, not_before=None):
+    """mask の部屋がすべて duration 分続けて空いている枠を早い順に最大 limit 件返す: [(序数, 開始分, 終了分)]
+
+    window=(開始分, 終了分) の時間帯・weekdays（0=月）の曜日で、序数 first から days 日分を探す。
+    日ごとに占有マスクを1回引き、k 枠連続の空きの開始位置はビット演算でまとめて求める。
+    同じ空き時間から重なる候補は出さない。not_before=(序数, 分) より前に始まる枠は除く。
+    """
+    k = -(-duration // SLOT_MINUTES)
+    allowed = interval_mask(*window)
+    found = []
+    for day in range(first, first + days):
+        if datetime.fromordinal(day).weekday() not in weekdays:
+            continue
+        busy = snap.occupancy_mask(day, mask)
+        if not_before and day == not_before[0]:
+            busy |= interval_mask(SLOT_ORIGIN, not_before[1])
+        free = allowed & ~busy
+        starts = free
+        for i in range(1, k):
+            starts &= free >> i
+        while starts:
+            i = (starts & -starts).bit_length() - 1
+            s = SLOT_ORIGIN + i * SLOT_MINUTES
+            found.append((day, s, s + duration))
+            if len(found) >= limit:
+                return found
+            starts &= ~((1 << (i + k)) - 1)
+    return found
+
+
+# -------------------------------------------------------------
+# インジケータ HTML
+# -------------------------------------------------------------
+GRID_CSS = """<style>
+.rg-row{display:flex;}
+.rg-row div{flex:1;background:#fff;border:1px solid #aaa;text-align:center;padding:4px;font-size:14px;font-weight:500;}
+.rg-row div.lb{flex:0 0 60px;padding:4px 0;font-weight:600;border-color:#999;background:#f9f9f9;overflow:hidden;white-space:nowrap;}
+.rg-row div.on{background:#ffcccc;}
+.rg-row div.off{background:#ccffcc;}
+.rg-row div.full{background:#ff3333;color:#fff;font-size:15px;font-weight:700;}
+.rg-day{font-size:1.5rem;font-weight:600;margin:1.2rem 0 .4rem;}
+.rg-group{font-size:.95rem;font-weight:600;margin:.5rem 0 .2rem;color:#555;}
+</style>"""
+
+
+def grid_row_html(label, mask, full=False):
+    """1区画1日分の行。full=True は部屋全体の占有（満）だけを表示する行"""
+    cells = [f"<div class='lb'>{label}</div>"]
+    for i, slot in enumerate(TIME_SLOTS):
+        if full:
+            cells.append("<div class='full'>満</div>" if mask >> i & 1 else "<div></div>")
+        else:
+            cells.append(f"<div class='{'on' if mask >> i & 1 else 'off'}'>{slot}</div>")
+    return f"<div class='rg-row'>{''.join(cells)}</div>"
+
+
+def build_grid_html(days, with_full=False):
+    """インジケータ全体を1つの HTML にする
+
+    days は (見出し, 部屋ごとの行) のタプルで、部屋ごとの行は
+    (部屋名, ((part 名, マスク), ...), 全 part 使用中のマスク)。部屋名が空なら見出しを出さない。
+    with_full=True なら part が2つ以上の部屋に「空満」行（全 part 使用中）を足す。
+    """
+    parts = [GRID_CSS]
+    for title, groups in days:
+        if title:
+            parts.append(f"<div class='rg-day'>📅 {title}</div>")
+        for group, rows, full in groups:
+            if group:
+                parts.append(f"<div class='rg-group'>🏢 {group}</div>")
+            for label, mask in rows:
+                parts.append(grid_row_html(label, mask))
+            if with_full and len(rows) > 1:
+                parts.append(grid_row_html("空満", full, full=True))
+    return "".join(parts)
@@ -0,0 +1,644 @@
+# =========================================================
+# Google Sheets 接続（ミラー用ストレージ）
+# - SheetsScheduler : 全 Sheets 呼び出しの共通窓口（トークンバケット／読込の相乗り／429時の適応バックオフ）
+# - GSheetPool      : プロセス共有の gspread クライアント／ワークシート
+# - LocalSheetPool  : FakeWorksheet 用の同じ窓口（オフライン・負荷試験用）
+# - GSheetStorage   : ReservationStorage の Sheets 実装（id = シートの ID 列、
+#                     ID → 行番号の表で取消行を特定。古い行は月別・年別のアーカイブシートへ移す）
+# - FakeWorksheet   : 遅延・クォータ超過を注入できるメモリ上のワークシート
+# gspread は GSheetPool の接続時にだけ読み込む（Fake だけならネットワーク不要）
+# =========================================================
+
+import logging
+import random
+import re
+import threading
+import time
+from collections import deque
+from datetime import datetime, timedelta
+
+from metrics import Histogram, payload_size
+from storage import ReservationStorage, normalize_row
+
+log = logging.getLogger(__name__)
+
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets",
+    "https://www.googleapis.com/auth/drive"
+]
+# ID は予約ごとに変わらない番号（主ストアの id）。旧シートに後から足せるよう最後の列に置く
+ID_COLUMN = "ID"
+ARCHIVE_PREFIX = "archive_"   # アーカイブシート名の接頭辞（例: archive_2025-09）
+SHEET_HEADER = ["区画", "日付", "開始", "終了", "担当者", "目的", "内線", "状態", "取消日", ID_COLUMN]
+# シート列 ↔ 保存行キー
+SHEET_KEYS = dict(zip(SHEET_HEADER,
+                      ["room", "date", "start", "end", "user", "purpose", "ext", "status", "cancel", "id"]))
+
+
+def a1(row, col):
+    """(行, 列) → "A1" 形式"""
+    letters = ""
+    while col:
+        col, rem = divmod(col - 1, 26)
+        letters = chr(65 + rem) + letters
+    return f"{letters}{row}"
+
+
+def parse_id(value):
+    """ID 列の値 → int（空・読めない値は None。gspread は数字のセルを int で返す）"""
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+def status_code(e):
+    """gspread.exceptions.APIError などから HTTP ステータスを取り出す（なければ None）"""
+    return getattr(getattr(e, "response", None), "status_code", None)
+
+
+# -------------------------------------------------------------
+# スケジューラ
+# -------------------------------------------------------------
+class SheetsScheduler:
+    """全セッションの Sheets 呼び出しを1本のトークンバケットに通す。
+
+    - 毎分 rate 回（最大 burst 回まで溜められる）を上限に呼び出しを払い出す
+    - 同じ read_key の読込が実行中なら、新たに呼ばずその結果を共有する
+    - 429 を受けたら速度を半分にし、連続回数に応じて一時停止してから再試行する。
+      成功が続けば速度を少しずつ元に戻す（AIMD）
+    - 呼び出しごとの所要時間（latency）と、操作名（op）ごとの回数・送受信バイト数を記録する
+    """
+    MAX_RETRIES = 5
+    MAX_PAUSE = 64.0
+
+    def __init__(self, rate_per_minute=50, burst=10):
+        self.max_rate = rate_per_minute / 60.0
+        self.rate = self.max_rate
+        self.burst = burst
+        self._tokens = float(burst)
+        self._stamp = time.monotonic()
+        self._paused_until = 0.0
+        self._strikes = 0
+        self._lock = threading.Lock()
+        self._inflight = {}
+        self.stats = {"calls": 0, "quota_errors": 0, "merged_reads": 0, "wait_seconds": 0.0}
+        self.latency = Histogram()
+        self.ops = {}
+
+    def _acquire(self):
+        """トークンが取れるまで待つ"""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if now >= self._paused_until and self._tokens >= 1:
+                    self._tokens -= 1
+                    self.stats["calls"] += 1
+                    return
+                wait = max(self._paused_until - now, (1 - self._tokens) / self.rate)
+                self.stats["wait_seconds"] += wait
+            time.sleep(wait)
+
+    def _on_quota_error(self):
+        with self._lock:
+            self.stats["quota_errors"] += 1
+            self._strikes += 1
+            self.rate = max(self.max_rate / 16, self.rate / 2)
+            pause = min(self.MAX_PAUSE, 2.0 ** self._strikes) * (0.5 + random.random() / 2)
+            self._paused_until = max(self._paused_until, time.monotonic() + pause)
+            self._tokens = 0.0
+
+    def _on_success(self):
+        with self._lock:
+            self._strikes = 0
+            self.rate = min(self.max_rate, self.rate + self.max_rate / 20)
+
+    def _observe(self, op, seconds, sent, received, error):
+        with self._lock:
+            self.latency.add(seconds)
+            entry = self.ops.setdefault(op, {"calls": 0, "errors": 0, "sent_bytes": 0, "received_bytes": 0})
+            entry["calls"] += 1
+            entry["errors"] += error
+            entry["sent_bytes"] += sent
+            entry["received_bytes"] += received
+
+    def report(self):
+        """診断用：stats・所要時間の分布・操作ごとの回数とバイト数の写し"""
+        with self._lock:
+            return {
+                "stats": dict(self.stats, rate_per_minute=round(self.rate * 60, 1)),
+                "latency": dict(self.latency.to_dict(), buckets=self.latency.buckets()),
+                "ops": {op: dict(v) for op, v in self.ops.items()},
+            }
+
+    def _run(self, fn, op, payload):
+        sent = payload_size(payload)
+        for attempt in range(self.MAX_RETRIES + 1):
+            self._acquire()
+            t0 = time.perf_counter()
+            try:
+                result = fn()
+            except Exception as e:
+                self._observe(op, time.perf_counter() - t0, sent, 0, True)
+                # 429 はサーバーが処理せずに拒否したもの。書込みでも再試行してよい
+                if status_code(e) != 429 or attempt == self.MAX_RETRIES:
+                    raise
+                self._on_quota_error()
+            else:
+                self._observe(op, time.perf_counter() - t0, sent, payload_size(result), False)
+                self._on_success()
+                return result
+
+    def run(self, fn, read_key=None, op="call", payload=None):
+        """fn() をトークンを取ってから実行する。read_key 付きの読込は実行中の同一読込に相乗りする
+
+        op は計測用の操作名、payload は送る値（送信バイト数の見積りに使う）。
+        """
+        if read_key is None:
+            return self._run(fn, op, payload)
+        with self._lock:
+            call = self._inflight.get(read_key)
+            leader = call is None
+            if leader:
+                call = self._inflight[read_key] = {"done": threading.Event()}
+            else:
+                self.stats["merged_reads"] += 1
+        if leader:
+            try:
+                call["result"] = self._run(fn, op, payload)
+            except Exception as e:
+                call["error"] = e
+            finally:
+                with self._lock:
+                    del self._inflight[read_key]
+                call["done"].set()
+        else:
+            call["done"].wait()
+        if "error" in call:
+            raise call["error"]
+        return call["result"]
+
+
+# -------------------------------------------------------------
+# ワークシートの窓口
+# -------------------------------------------------------------
+class GSheetPool:
+    """全セッションで共有する gspread クライアント／ワークシート。
+
+    接続は最初の呼び出しのときに行う（作るだけでは通信しないので、Sheets に
+    つながらなくてもアプリは起動できる）。トークンは期限前にバックグラウンドで更新し、
+    ハンドルが失効していれば呼び出し時に再接続して1回だけやり直す。呼び出しはすべて scheduler を通る。
+    """
+    REFRESH_MARGIN = timedelta(minutes=5)
+
+    def __init__(self, info, sheet_id, scheduler=None):
+        self._info = dict(info)
+        self._sheet_id = sheet_id
+        self.scheduler = scheduler or SheetsScheduler()
+        self._lock = threading.RLock()
+        self._creds = None
+        self._book = None
+        self._sheet = None
+        self._tabs = {}
+        threading.Thread(target=self._refresh_loop, name="gsheet-token", daemon=True).start()
+
+    def _connect(self):
+        import gspread
+        from google.auth.transport.requests import Request
+        from google.oauth2.service_account import Credentials
+
+        creds = Credentials.from_service_account_info(self._info, scopes=SCOPES)
+        creds.refresh(Request())
+        client = gspread.authorize(creds)
+        self._creds = creds
+        self._book = self.scheduler.run(lambda: client.open_by_key(self._sheet_id), op="open")
+        self._sheet = self._book.sheet1
+        self._tabs = {}
+
+    def _open_tab(self, title):
+        """同じスプレッドシート内の別ワークシート（なければヘッダ付きで作る）"""
+        import gspread
+
+        try:
+            return self._book.worksheet(title)
+        except gspread.WorksheetNotFound:
+            sheet = self._book.add_worksheet(title, rows=1, cols=len(SHEET_HEADER))
+            sheet.update([SHEET_HEADER])
+            return sheet
+
+    def worksheet(self, title=None):
+        """title=None なら予約シート（sheet1）、それ以外は同名のワークシート"""
+        with self._lock:
+            if self._sheet is None:
+                self._connect()
+            if title is None:
+                return self._sheet
+            if title not in self._tabs:
+                self._tabs[title] = self._open_tab(title)
+            return self._tabs[title]
+
+    def titles(self):
+        """スプレッドシート内のワークシート名の一覧"""
+        with self._lock:
+            if self._sheet is None:
+                self._connect()
+            book = self._book
+        return self.scheduler.run(lambda: [ws.title for ws in book.worksheets()], op="worksheets")
+
+    def invalidate(self):
+        with self._lock:
+            self._sheet = None
+
+    def _refresh_loop(self):
+        from google.auth.transport.requests import Request
+
+        wakeup = threading.Event()
+        while True:
+            with self._lock:
+                expiry = self._creds.expiry if self._creds else None
+            if expiry is None:
+                wait = 60
+            else:
+                wait = (expiry - self.REFRESH_MARGIN - datetime.utcnow()).total_seconds()
+            wakeup.wait(max(30, wait))
+            try:
+                with self._lock:
+                    if self._creds is not None:
+                        self._creds.refresh(Request())
+            except Exception:
+                # 更新失敗時は次回の呼び出しで再接続される
+                self.invalidate()
+
+    def _call(self, fn, idempotent, sheet):
+        try:
+            return fn(self.worksheet(sheet))
+        except OSError:
+            if not idempotent:
+                raise
+        except Exception as e:
+            if status_code(e) not in (401, 404):
+                raise
+        self.invalidate()
+        return fn(self.worksheet(sheet))
+
+    def call(self, fn, idempotent=True, read_key=None, sheet=None, op="call", payload=None):
+        """fn(worksheet) を実行。失効（401/404）や接続断なら再接続して1回だけ再試行
+
+        追記のように二重実行が困るものは idempotent=False とし、
+        サーバーが確実に拒否した場合（401/404）のみ再試行する。
+        sheet にワークシート名を渡すと予約シート以外（アーカイブ等）を対象にする。
+        op・payload は計測用（SheetsScheduler.run を参照）。
+        """
+        return self.scheduler.run(lambda: self._call(fn, idempotent, sheet), read_key=read_key,
+                                  op=op, payload=payload)
+
+
+class LocalSheetPool:
+    """FakeWorksheet を GSheetPool と同じ窓口（scheduler 経由）で使う"""
+
+    def __init__(self, worksheet, scheduler=None):
+        self.sheet = worksheet
+        self.scheduler = scheduler or SheetsScheduler()
+        self.tabs = {}
+
+    def worksheet(self, title=None):
+        if title is None:
+            return self.sheet
+        if title not in self.tabs:
+            self.tabs[title] = FakeWorksheet([SHEET_HEADER], latency=self.sheet.latency, title=title)
+        return self.tabs[title]
+
+    def titles(self):
+        return [self.sheet.title] + list(self.tabs)
+
+    def call(self, fn, idempotent=True, read_key=None, sheet=None, op="call", payload=None):
+        return self.scheduler.run(lambda: fn(self.worksheet(sheet)), read_key=read_key, op=op, payload=payload)
+
+
+# -------------------------------------------------------------
+# ストレージ実装
+# -------------------------------------------------------------
+class GSheetStorage(ReservationStorage):
+    """Sheets 1枚を保存先とする実装。全面は1行（区画=全面）で持つ。
+
+    各行の id は ID 列に持つ。ID → 行番号の表（_rows）を load_range・insert_many・
+    archive のたびに更新し、追記のときに既にある id を確かめるのに使う。
+    取消は表を使わず、毎回 ID 列を読み直して該当行のセルだけを書き換える
+    （シートが手で並べ替えられたり、行が挿入・削除されたりしても別の行を書き換えないように）。
+    load_range は各行の sheet_row（行番号）も返す。ID 列が空の行（ID 列導入前の行）は id=None なので、
+    呼び出し側が id を決めて assign_ids で書き込む。同じ ID が複数行にあるときは、表には先の行を載せる。
+
+    archive() で古い行・取消済みの行を archive_by（"month" / "year"）ごとの
+    アーカイブシート（例: "archive_2025-09"）へ移し、予約シートを小さく保つ。
+    移した行は load_archived() で読める（主ストアを作り直すときの取込用）。
+    """
+
+    def __init__(self, pool, archive_by="month"):
+        self.pool = pool
+        self.archive_by = archive_by
+        self._rows = None   # ID → 行番号（未読込なら None）
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _parse(rec):
+        """get_all_records の1件 → 保存行（id は ID 列、空なら None）"""
+        row = normalize_row({SHEET_KEYS[k]: v for k, v in rec.items() if k in SHEET_KEYS})
+        return {**row, "id": parse_id(rec.get(ID_COLUMN))}
+
+    def load_range(self, start=None, end=None):
+        def _read(sheet):
+            records = sheet.get_all_records()
+            if not records and sheet.row_values(1) != SHEET_HEADER:
+                # 空シート：以降の追記のためにヘッダだけ書いておく
+                sheet.update([SHEET_HEADER])
+            return records
+
+        rows, index = [], {}
+        for row_no, rec in enumerate(self.pool.call(_read, read_key="all_records", op="get_all_records"), start=2):
+            row = self._parse(rec)
+            if row["id"] is not None:
+                index.setdefault(row["id"], row_no)
+            if (start is None or row["date"] >= str(start)) and (end is None or row["date"] < str(end)):
+                rows.append({**row, "sheet_row": row_no})
+        with self._lock:
+            self._rows = index
+        return rows
+
+    def _reload_ids(self):
+        """ID 列だけを読み直して ID → 行番号の表を作り直す。読んだ {行番号: id} を返す"""
+        col = SHEET_HEADER.index(ID_COLUMN) + 1
+        values = self.pool.call(lambda sheet: sheet.col_values(col), read_key="id_column", op="col_values")
+        cells, index = {}, {}
+        for row_no, value in enumerate(values[1:], start=2):
+            rid = parse_id(value)
+            if rid is not None:
+                cells[row_no] = rid
+                index.setdefault(rid, row_no)
+        with self._lock:
+            self._rows = index
+        return cells
+
+    def insert(self, row):
+        return self.insert_many([row])[0]
+
+    def insert_many(self, rows):
+        """まとめて1回の append_rows で追記し、各行の id を返す
+
+        id のない行（ミラーでなく単独で使うとき）には、シート上の最大の ID の次から振る。
+        ID → 行番号の表がないとき（起動直後や、前回の追記が書けたか分からないまま失敗したとき）は
+        ID 列を読み直し、既にシートにある id の行は追記しない（再送で同じ行が二重にならないように）。
+        """
+        if self._rows is None:
+            self._reload_ids()
+        with self._lock:
+            next_id = max(self._rows, default=0) + 1
+            ids, new = [], []
+            for r in rows:
+                if r.get("id") is None:
+                    ids.append(next_id)
+                    new.append((r, next_id))
+                    next_id += 1
+                else:
+                    ids.append(r["id"])
+                    if r["id"] not in self._rows:
+                        new.append((r, r["id"]))
+            if not new:
+                return ids
+            values = [[normalize_row({**r, "id": rid})[SHEET_KEYS[k]] for k in SHEET_HEADER] for r, rid in new]
+            try:
+                res = self.pool.call(lambda sheet: sheet.append_rows(values, table_range="A1"), idempotent=False,
+                                     op="append_rows", payload=values)
+            except Exception:
+                self._rows = None   # サーバー側では書けている場合がある。再送の前に ID 列を読み直す
+                raise
+            # updatedRange 例: "'シート1'!A15:J17" → 15, 16, 17
+            m = re.search(r"![A-Z]+(\d+)", res.get("updates", {}).get("updatedRange", ""))
+            if m:
+                self._rows.update(zip([rid for _, rid in new], range(int(m.group(1)), int(m.group(1)) + len(new))))
+            else:
+                self._rows = None   # 行番号が分からないので、次の追記・取消の前に読み直す
+        return ids
+
+    def stale_id_rows(self, mapping):
+        """{行番号: id} のうち、ID 列にまだその id が入っていない行だけを返す。ID 列だけを読む"""
+        cells = self._reload_ids()
+        return {row: rid for row, rid in mapping.items() if cells.get(row) != rid}
+
+    def load_archived(self):
+        """アーカイブシート（archive_*）の全行。各行に sheet（シート名）と sheet_row（行番号）を付ける"""
+        rows = []
+        for title in sorted(t for t in self.pool.titles() if t.startswith(ARCHIVE_PREFIX)):
+            records = self.pool.call(lambda sheet: sheet.get_all_records(), sheet=title,
+                                     read_key=f"all_records:{title}", op="get_all_records")
+            rows.extend({**self._parse(rec), "sheet": title, "sheet_row": row_no}
+                        for row_no, rec in enumerate(records, start=2))
+        return rows
+
+    def assign_ids(self, mapping, sheet=None):
+        """{行番号: id} を ID 列へ1回の batch_update で書き込む（ID 列が空・重複した行の移行用）
+
+        sheet はワークシート名（None なら予約シート、アーカイブシートの行ならその名前）。
+        """
+        col = SHEET_HEADER.index(ID_COLUMN) + 1
+        updates = [{"range": a1(1, col), "values": [[ID_COLUMN]]}] + [
+            {"range": a1(row, col), "values": [[rid]]} for row, rid in sorted(mapping.items())
+        ]
+        if mapping:
+            self.pool.call(lambda ws: ws.batch_update(updates), sheet=sheet, op="batch_update", payload=updates)
+            with self._lock:
+                if self._rows is not None and sheet is None:
+                    self._rows.update((rid, row) for row, rid in mapping.items())
+
+    def cancel(self, ids, cancel_date):
+        missing = set(self.cancel_many([(rid, cancel_date) for rid in ids]))
+        return [rid for rid in ids if rid not in missing]
+
+    def cancel_many(self, items):
+        """取消した予約の行の「状態」「取消日」セルだけを1回の batch_update で更新
+
+        行番号は直前に読み直した ID 列で引く（col_values 1回）。同じ ID の行が複数あれば
+        すべて更新する。シートに見つからなかった id のリストを返す。
+        """
+        items = dict(items)
+        targets = sorted((row, rid) for row, rid in self._reload_ids().items() if rid in items)
+        c0 = SHEET_HEADER.index("状態") + 1
+        updates = [
+            {
+                "range": f"{a1(row, c0)}:{a1(row, c0 + 1)}",
+                "values": [["cancel", str(items[rid])]],
+            }
+            for row, rid in targets
+        ]
+        if updates:
+            self.pool.call(lambda sheet: sheet.batch_update(updates), op="batch_update", payload=updates)
+        found = {rid for _, rid in targets}
+        missing = [rid for rid in items if rid not in found]
+        if missing:
+            log.warning("シートに ID が見つからないため取消を反映できない予約があります: %s", missing)
+        return missing
+
+    def archive_title(self, date):
+        key = str(date)[:7 if self.archive_by == "month" else 4]
+        return f"{ARCHIVE_PREFIX}{key or 'unknown'}"
+
+    def archive(self, before):
+        """日付が before より前の行と取消済みの行をアーカイブシートへ移し、予約シートを詰め直す
+
+        移した行数を返す。行番号が変わるので ID → 行番号の表も作り直す
+        （詰め直しと取消が入れ違わないよう、送信待ちがない時に呼ぶ）。
+        """
+        values = self.pool.call(lambda sheet: sheet.get_all_values(), op="get_all_values")
+        if not values:
+            return 0
+        header, width = values[0], len(values[0])
+        col_date, col_status = header.index("日付"), header.index("状態")
+        col_id = header.index(ID_COLUMN) if ID_COLUMN in header else None
+        keep, moved, index = [], {}, {}
+        for cells in values[1:]:
+            cells = list(cells) + [""] * (width - len(cells))
+            if cells[col_date] < str(before) or cells[col_status] == "cancel":
+                moved.setdefault(self.archive_title(cells[col_date]), []).append(cells)
+            else:
+                keep.append(cells)
+                rid = parse_id(cells[col_id]) if col_id is not None else None
+                if rid is not None:
+                    index[rid] = len(keep) + 1
+        if not moved:
+            return 0
+        # 先にアーカイブへ追記してから予約シートを書き直す（途中で失敗しても行は失われない）
+        for title, rows in sorted(moved.items()):
+            self.pool.call(lambda sheet, rows=rows: sheet.append_rows(rows, table_range="A1"),
+                           idempotent=False, sheet=title, op="append_rows", payload=rows)
+        blank = [[""] * width for _ in range(len(values) - 1 - len(keep))]
+        rewrite = [header] + keep + blank
+        self.pool.call(lambda sheet: sheet.update(rewrite, "A1"), op="update", payload=rewrite)
+        with self._lock:
+            self._rows = index
+        return len(values) - 1 - len(keep)
+
+
+# -------------------------------------------------------------
+# 試験用のメモリ上ワークシート
+# -------------------------------------------------------------
+class FakeAPIError(Exception):
+    """gspread.exceptions.APIError と同じく response.status_code を持つ例外"""
+
+    class _Response:
+        def __init__(self, code):
+            self.status_code = code
+
+    def __init__(self, code, message=""):
+        super().__init__(message or f"HTTP {code}")
+        self.response = self._Response(code)
+
+
+class FakeWorksheet:
+    """gspread.Worksheet のうち、このアプリが使うメソッドだけを持つメモリ上のシート。
+
+    各呼び出しに latency 秒（±jitter）の遅延を入れ、直近60秒の呼び出しが
+    quota_per_minute を超えると 429 を返す。fail_next(n, code) で次の n 回を失敗させる。
+    """
+
+    def __init__(self, values=None, latency=0.0, jitter=0.0, quota_per_minute=None, title="Sheet1"):
+        self.values = [list(r) for r in (values or [])]
+        self.latency = latency
+        self.jitter = jitter
+        self.quota_per_minute = quota_per_minute
+        self.title = title
+        self.calls = deque()
+        self.call_count = 0
+        self._fail = deque()
+        self._lock = threading.Lock()
+
+    def fail_next(self, n=1, code=429):
+        self._fail.extend([code] * n)
+
+    def _hit(self):
+        with self._lock:
+            now = time.monotonic()
+            self.call_count += 1
+            while self.calls and now - self.calls[0] > 60:
+                self.calls.popleft()
+            self.calls.append(now)
+            over = self.quota_per_minute is not None and len(self.calls) > self.quota_per_minute
+            code = self._fail.popleft() if self._fail else (429 if over else None)
+        if self.latency or self.jitter:
+            time.sleep(max(0.0, self.latency + random.uniform(-self.jitter, self.jitter)))
+        if code:
+            raise FakeAPIError(code, "Quota exceeded" if code == 429 else "")
+
+    def _range(self, first, n):
+        return {"updates": {"updatedRange": f"'{self.title}'!A{first}:{a1(first + n - 1, len(SHEET_HEADER))}"}}
+
+    def _used_rows(self):
+        """値のある最後の行まで（実際の API と同じく末尾の空行は返さない）"""
+        n = len(self.values)
+        while n and not any(self.values[n - 1]):
+            n -= 1
+        return n
+
+    def get_all_values(self):
+        self._hit()
+        with self._lock:
+            return [list(r) for r in self.values[:self._used_rows()]]
+
+    def get_all_records(self):
+        values = self.get_all_values()
+        if not values:
+            return []
+        header = values[0]
+        return [dict(zip(header, r + [""] * (len(header) - len(r)))) for r in values[1:]]
+
+    def col_values(self, col):
+        """値のある最後の行までの col 列目（末尾の空セルは返さない）"""
+        self._hit()
+        with self._lock:
+            cells = [r[col - 1] if col <= len(r) else "" for r in self.values[:self._used_rows()]]
+        while cells and cells[-1] == "":
+            cells.pop()
+        return cells
+
+    def row_values(self, row):
+        self._hit()
+        with self._lock:
+            return list(self.values[row - 1]) if row <= len(self.values) else []
+
+    def update(self, values, range_name="A1"):
+        self._hit()
+        with self._lock:
+            m = re.match(r"([A-Z]+)(\d+)", range_name)
+            row = int(m.group(2)) if m else 1
+            for i, r in enumerate(values):
+                while len(self.values) < row + i:
+                    self.values.append([])
+                self.values[row + i - 1] = list(r)
+
+    def append_row(self, values, **kwargs):
+        return self.append_rows([values], **kwargs)
+
+    def append_rows(self, values, **kwargs):
+        self._hit()
+        with self._lock:
+            first = self._used_rows() + 1
+            del self.values[first - 1:first - 1 + len(values)]
+            self.values[first - 1:first - 1] = [list(r) for r in values]
+        return self._range(first, len(values))
+
+    def batch_update(self, data, **kwargs):
+        self._hit()
+        with self._lock:
+            for item in data:
+                m = re.match(r"([A-Z]+)(\d+)", item["range"])
+                col = 0
+                for ch in m.group(1):
+                    col = col * 26 + ord(ch) - 64
+                row = int(m.group(2))
+                while len(self.values) < row:
+                    self.values.append([])
+                cells = self.values[row - 1]
+                for i, v in enumerate(item["values"][0]):
+                    cells.extend([""] * (col + i - len(cells)))
+                    cells[col + i - 1] = v
+        return {"totalUpdatedCells": sum(len(item["values"][0]) for item in data)}
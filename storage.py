@@ -0,0 +1,691 @@
+# =========================================================
+# 予約データの保存先（ストレージ）
+# - ReservationStorage : 保存先の共通インターフェース
+# - SQLiteStorage      : ローカルSQLite（WAL）。既定の主ストア
+#                        （利用状況の集計表も同じトランザクションで更新）
+# - MirroredStorage    : 主ストア＋ミラー（Google Sheets）への非同期反映
+#                        （SQLite内の送信待ちキューから後書きで一括送信）
+# Streamlit には依存しない（オフラインでも単体で動かせる）
+# =========================================================
+
+import logging
+import os
+import sqlite3
+import threading
+import time
+from datetime import date as _date, timedelta
+
+log = logging.getLogger(__name__)
+
+# 予約1件（保存上の1行）のキー。全面は room="全面" の1行で持ち、
+# user は (全面) を付けない素の担当者名。
+FIELDS = ["room", "date", "start", "end", "user", "purpose", "ext", "status", "cancel"]
+# 同じ予約かどうかを比べるキー（状態・取消日を除く）
+BOOKING_KEYS = FIELDS[:7]
+
+
+def normalize_row(row):
+    """保存用の1行を正規化（欠けた項目の補完、日付・時刻の文字列化）"""
+    out = {k: "" if row.get(k) is None else str(row.get(k)) for k in FIELDS}
+    out["status"] = out["status"] or "active"
+    if "id" in row:
+        out["id"] = row["id"]
+    return out
+
+
+class ReservationStorage:
+    """保存先の共通インターフェース。行は FIELDS ＋ "id" の dict。"""
+
+    def load_range(self, start=None, end=None):
+        """date が [start, end) の行（None は無制限）を日付・開始順で返す"""
+        raise NotImplementedError
+
+    def iter_range(self, start=None, end=None):
+        """load_range と同じ行を1行ずつ返す（書出しなど、全件を一度に持ちたくない用途向け）"""
+        return iter(self.load_range(start, end))
+
+    def list_by_date(self, date):
+        return self.load_range(str(date), _next_day(date))
+
+    def revision(self):
+        """書込みのたびに増える版番号。読み直しが必要かをほぼ無料で確かめるためのもの"""
+        raise NotImplementedError
+
+    def load_changes(self, since):
+        """版番号 since より後に追加・変更された行（取消も含む）"""
+        raise NotImplementedError
+
+    def usage_totals(self):
+        """利用状況の集計（予約・取消のたびに更新済みのもの）。SQLiteStorage.usage_totals を参照"""
+        raise NotImplementedError
+
+    def insert(self, row):
+        """1行追加して id を返す"""
+        raise NotImplementedError
+
+    def cancel(self, ids, cancel_date):
+        """指定 id を取消状態にし、取り消した id のリストを返す（見つからない id は含めない）"""
+        raise NotImplementedError
+
+    def insert_many(self, rows):
+        return [self.insert(r) for r in rows]
+
+    def insert_checked(self, rows, conflicts):
+        """保存先の最新の状態で衝突を確かめ、衝突しない行だけを追加する → (id のリスト, 衝突した行)
+
+        conflicts(row, existing) は row が existing（同じ日の有効な行）のどれかと重なるかを返す関数。
+        確認と追加は他の書込みに割り込まれない1つの操作として行う（実装ごとに保証する）。
+        """
+        raise NotImplementedError
+
+    def cancel_many(self, items):
+        """items: [(id, 取消日)]。取消日ごとにまとめて cancel する"""
+        by_date = {}
+        for rid, cancel_date in items:
+            by_date.setdefault(str(cancel_date), []).append(rid)
+        for cancel_date, ids in by_date.items():
+            self.cancel(ids, cancel_date)
+
+
+def _next_day(date):
+    return str(_date.fromisoformat(str(date)) + timedelta(days=1))
+
+
+USAGE_SLOT = 30   # 集計の時間枠（分）。枠の番号は 0時からの (分 // USAGE_SLOT)
+
+
+def usage_minutes(row):
+    """保存行 → [(月, 曜日, 枠番号, 区画, 使用分数)]。日付・時刻が読めなければ ValueError"""
+    day = _date.fromisoformat(row["date"])
+    start, end = (int(h) * 60 + int(m) for h, m in (t.split(":") for t in (row["start"], row["end"])))
+    out = []
+    for slot in range(start // USAGE_SLOT, -(-end // USAGE_SLOT)):
+        minutes = min(end, (slot + 1) * USAGE_SLOT) - max(start, slot * USAGE_SLOT)
+        if minutes > 0:
+            out.append((row["date"][:7], day.weekday(), slot, row["room"], minutes))
+    return out
+
+
+class SQLiteStorage(ReservationStorage):
+    """ローカルSQLite（WALモード）。date・room に索引を張った主ストア。
+
+    接続はスレッドごとに持ち、書込みはプロセス内ではロックで、プロセス間では
+    書込みトランザクション（BEGIN IMMEDIATE）で1つずつ直列に行う。
+    衝突確認つきの登録（insert_checked）も同じで、確認と追加を1つの書込みトランザクションで行う。
+    """
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS reservations (
+        id         INTEGER PRIMARY KEY AUTOINCREMENT,
+        room       TEXT NOT NULL,
+        date       TEXT NOT NULL,
+        start_time TEXT NOT NULL,
+        end_time   TEXT NOT NULL,
+        user       TEXT NOT NULL DEFAULT '',
+        purpose    TEXT NOT NULL DEFAULT '',
+        ext        TEXT NOT NULL DEFAULT '',
+        status     TEXT NOT NULL DEFAULT 'active',
+        cancel     TEXT NOT NULL DEFAULT '',
+        sheet_row  INTEGER,  -- ミラーに ID 列がなかった頃の行番号（ID 列への移行にだけ使う）
+        revision   INTEGER NOT NULL DEFAULT 0
+    );
+    CREATE INDEX IF NOT EXISTS idx_reservations_date_room ON reservations (date, room);
+    CREATE INDEX IF NOT EXISTS idx_reservations_room ON reservations (room);
+    CREATE INDEX IF NOT EXISTS idx_reservations_revision ON reservations (revision);
+    -- 版番号（key = 'revision'）。予約を書き換えるトランザクションごとに1つ増える
+    -- ほかに 'usage'（集計表を作成済み）、'mirror_ids'（ミラーの ID 列への移行済み）
+    CREATE TABLE IF NOT EXISTS meta (
+        key   TEXT PRIMARY KEY,
+        value INTEGER NOT NULL
+    );
+    -- ミラーへの送信待ち。予約1件につき1行で、同じ予約への変更はここで1つにまとまる
+    CREATE TABLE IF NOT EXISTS mirror_outbox (
+        reservation_id INTEGER PRIMARY KEY,
+        op             TEXT NOT NULL,
+        version        INTEGER NOT NULL DEFAULT 0,
+        queued_at      REAL NOT NULL,
+        attempts       INTEGER NOT NULL DEFAULT 0,
+        next_try_at    REAL NOT NULL DEFAULT 0,
+        last_error     TEXT NOT NULL DEFAULT ''
+    );
+    -- 利用状況の集計。予約・取消と同じトランザクションで足し引きするので、分析画面は全行を読まない
+    -- usage_minutes : 月・曜日・時間枠・区画ごとの有効な予約の使用分数
+    CREATE TABLE IF NOT EXISTS usage_minutes (
+        month   TEXT NOT NULL,
+        weekday INTEGER NOT NULL,
+        slot    INTEGER NOT NULL,
+        room    TEXT NOT NULL,
+        minutes INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, weekday, slot, room)
+    );
+    -- usage_bookings : 月・区画ごとの予約件数（取消を含む）と、そのうち取消された件数
+    CREATE TABLE IF NOT EXISTS usage_bookings (
+        month     TEXT NOT NULL,
+        room      TEXT NOT NULL,
+        booked    INTEGER NOT NULL DEFAULT 0,
+        cancelled INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (month, room)
+    );
+    """
+    COLUMNS = "id, room, date, start_time, end_time, user, purpose, ext, status, cancel"
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._write_lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._write_lock:
+            conn = self._conn()
+            columns = {c[1] for c in conn.execute("PRAGMA table_info(reservations)")}
+            if columns and "revision" not in columns:
+                # 版番号導入前の DB
+                conn.execute("ALTER TABLE reservations ADD COLUMN revision INTEGER NOT NULL DEFAULT 0")
+            conn.executescript(self.SCHEMA)
+            if conn.execute("SELECT 1 FROM meta WHERE key = 'usage'").fetchone() is None:
+                # 集計表の導入前の DB：既存の予約から一度だけ作る
+                self._rebuild_usage(conn)
+
+    def _conn(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _to_row(rec):
+        rid, room, date, start, end, user, purpose, ext, status, cancel = rec
+        return {"id": rid, "room": room, "date": date, "start": start, "end": end, "user": user,
+                "purpose": purpose, "ext": ext, "status": status, "cancel": cancel}
+
+    def load_range(self, start=None, end=None):
+        return list(self.iter_range(start, end))
+
+    def iter_range(self, start=None, end=None):
+        sql = f"SELECT {self.COLUMNS} FROM reservations"
+        cond, args = [], []
+        if start is not None:
+            cond.append("date >= ?")
+            args.append(str(start))
+        if end is not None:
+            cond.append("date < ?")
+            args.append(str(end))
+        if cond:
+            sql += " WHERE " + " AND ".join(cond)
+        sql += " ORDER BY date, start_time, id"
+        return (self._to_row(rec) for rec in self._conn().execute(sql, args))
+
+    @staticmethod
+    def _bump(conn):
+        """版番号を1つ進めて返す（書込みトランザクションの中で呼ぶ）"""
+        conn.execute("INSERT INTO meta (key, value) VALUES ('revision', 1)"
+                     " ON CONFLICT (key) DO UPDATE SET value = value + 1")
+        return conn.execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()[0]
+
+    def revision(self):
+        rec = self._conn().execute("SELECT value FROM meta WHERE key = 'revision'").fetchone()
+        return rec[0] if rec else 0
+
+    def load_changes(self, since):
+        rows = self._conn().execute(
+            f"SELECT {self.COLUMNS} FROM reservations WHERE revision > ? ORDER BY id", (since,))
+        return [self._to_row(rec) for rec in rows]
+
+    def get(self, ids):
+        ids = list(ids)
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        rows = self._conn().execute(
+            f"SELECT {self.COLUMNS} FROM reservations WHERE id IN ({marks})", ids)
+        return [self._to_row(rec) for rec in rows]
+
+    def insert(self, row):
+        return self.insert_many([row])[0]
+
+    def insert_many(self, rows, enqueue=False):
+        """複数行を1トランザクションで追加し、id のリストを返す
+
+        行に id があればその id で登録する（ミラーからの取込用。None なら採番）。
+        enqueue=True なら同じトランザクションでミラー送信待ちにも積む。
+        """
+        rows = [normalize_row(r) for r in rows]
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                ids = self._insert(conn, rows, enqueue)
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return ids
+
+    def insert_checked(self, rows, conflicts, enqueue=False):
+        """衝突しない行だけを1トランザクションで追加する → (id のリスト, 衝突した行)
+
+        書込みのロックを取ってから書込みトランザクションを始め、その中で読んだ
+        その日の有効な行（他のセッション・プロセスの書込みも含む最新の状態）に対して
+        conflicts(row, existing) で確かめる。同じ呼び出しで先に受け付けた行とも比べる。
+        enqueue=True なら同じトランザクションでミラー送信待ちにも積む。
+        """
+        rows = [normalize_row(r) for r in rows]
+        if not rows:
+            return [], []
+        dates = sorted({r["date"] for r in rows})
+        marks = ",".join("?" * len(dates))
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                existing = {}
+                for rec in conn.execute(
+                        f"SELECT {self.COLUMNS} FROM reservations WHERE status = 'active' AND date IN ({marks})",
+                        dates):
+                    row = self._to_row(rec)
+                    existing.setdefault(row["date"], []).append(row)
+                accepted, rejected = [], []
+                for r in rows:
+                    same_day = existing.setdefault(r["date"], [])
+                    if conflicts(r, same_day):
+                        rejected.append(r)
+                    else:
+                        accepted.append(r)
+                        if r["status"] == "active":
+                            same_day.append(r)
+                ids = self._insert(conn, accepted, enqueue) if accepted else []
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return ids, rejected
+
+    def _insert(self, conn, rows, enqueue):
+        """正規化済みの rows を追加して id のリストを返す（書込みトランザクションの中で呼ぶ）"""
+        revision = self._bump(conn)
+        ids = []
+        for r in rows:
+            cur = conn.execute(
+                "INSERT INTO reservations (id, room, date, start_time, end_time, user, purpose, ext,"
+                " status, cancel, revision) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                [r.get("id")] + [r[k] for k in FIELDS] + [revision])
+            ids.append(cur.lastrowid)
+        self._count_usage(conn, rows)
+        if enqueue:
+            self._enqueue(conn, ids, "insert")
+        return ids
+
+    def cancel(self, ids, cancel_date, enqueue=False):
+        """有効な行だけを取り消し、取り消した id のリストを返す
+
+        見つからない id・取消済みの id は何もしない（取消日・版番号は変えず、送信待ちにも積まない）。
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+        marks = ",".join("?" * len(ids))
+        with self._write_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                active = [self._to_row(rec) for rec in conn.execute(
+                    f"SELECT {self.COLUMNS} FROM reservations WHERE status = 'active' AND id IN ({marks})", ids)]
+                done = [r["id"] for r in active]
+                if done:
+                    marks = ",".join("?" * len(done))
+                    conn.execute(
+                        f"UPDATE reservations SET status = 'cancel', cancel = ?, revision = ?"
+                        f" WHERE status = 'active' AND id IN ({marks})",
+                        [str(cancel_date), self._bump(conn)] + done)
+                    self._count_usage(conn, active, cancelling=True)
+                    if enqueue:
+                        self._enqueue(conn, done, "cancel")
+                conn.execute("COMMIT")
+            except BaseException:
+                conn.execute("ROLLBACK")
+                raise
+        return done
+
+    # --- 利用状況の集計 ---
+    @staticmethod
+    def _count_usage(conn, rows, cancelling=False):
+        """rows を集計表に反映する（書込みトランザクションの中で呼ぶ）
+
+        新規の行は予約件数を1足し、有効なら使用分数を、取消済みなら取消件数を足す。
+        cancelling=True は有効だった行を取り消すときで、使用分数を引いて取消件数を足す。
+        日付・時刻が読めない行は数えない。
+        """
+        minutes, bookings = {}, {}
+        for r in rows:
+            try:
+                parts = usage_minutes(r)
+            except ValueError:
+                continue
+            if cancelling or r["status"] == "active":
+                for month, weekday, slot, room, m in parts:
+                    key = (month, weekday, slot, room)
+                    minutes[key] = minutes.get(key, 0) + (-m if cancelling else m)
+            key = (r["date"][:7], r["room"])
+            b, c = bookings.get(key, (0, 0))
+            bookings[key] = (b + (not cancelling), c + (cancelling or r["status"] == "cancel"))
+        conn.executemany(
+            "INSERT INTO usage_minutes (month, weekday, slot, room, minutes) VALUES (?, ?, ?, ?, ?)"
+            " ON CONFLICT (month, weekday, slot, room) DO UPDATE SET minutes = minutes + excluded.minutes",
+            [key + (m,) for key, m in minutes.items()])
+        conn.executemany(
+            "INSERT INTO usage_bookings (month, room, booked, cancelled) VALUES (?, ?, ?, ?)"
+            " ON CONFLICT (month, room) DO UPDATE SET"
+            " booked = booked + excluded.booked, cancelled = cancelled + excluded.cancelled",
+            [key + bc for key, bc in bookings.items()])
+
+    def _rebuild_usage(self, conn):
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute("DELETE FROM usage_minutes")
+            conn.execute("DELETE FROM usage_bookings")
+            cur = conn.execute(f"SELECT {self.COLUMNS} FROM reservations")
+            while True:
+                batch = cur.fetchmany(10000)
+                if not batch:
+                    break
+                self._count_usage(conn, [self._to_row(rec) for rec in batch])
+            conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES ('usage', 1)")
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+
+    def usage_totals(self):
+        """集計表の中身: ([(月, 曜日, 枠番号, 区画, 使用分数)], [(月, 区画, 予約件数, 取消件数)])"""
+        conn = self._conn()
+        minutes = conn.execute(
+            "SELECT month, weekday, slot, room, minutes FROM usage_minutes WHERE minutes != 0").fetchall()
+        bookings = conn.execute("SELECT month, room, booked, cancelled FROM usage_bookings").fetchall()
+        return minutes, bookings
+
+    # --- ミラー送信待ちキュー ---
+    @staticmethod
+    def _enqueue(conn, ids, op):
+        # 未送信の insert に後から cancel が来ても insert のまま（送信時に最新の状態を書く）
+        now = time.time()
+        conn.executemany(
+            "INSERT INTO mirror_outbox (reservation_id, op, queued_at) VALUES (?, ?, ?)"
+            " ON CONFLICT (reservation_id) DO UPDATE SET"
+            " op = CASE WHEN op = 'insert' THEN 'insert' ELSE excluded.op END,"
+            " version = version + 1, next_try_at = 0",
+            [(rid, op, now) for rid in ids])
+
+    def outbox_due(self, limit=200):
+        """送信時刻に達した送信待ちを古い順に返す: [(id, op, attempts, version)]"""
+        return self._conn().execute(
+            "SELECT reservation_id, op, attempts, version FROM mirror_outbox WHERE next_try_at <= ?"
+            " ORDER BY queued_at LIMIT ?", (time.time(), limit)).fetchall()
+
+    def outbox_done(self, entries):
+        """送信済みの [(id, version)] を消す。送信中に変更が積まれたものは残し、
+        送った insert は以後 cancel として送る（行は既にミラー上にある）"""
+        with self._write_lock:
+            conn = self._conn()
+            conn.executemany("DELETE FROM mirror_outbox WHERE reservation_id = ? AND version = ?", entries)
+            conn.executemany("UPDATE mirror_outbox SET op = 'cancel' WHERE reservation_id = ? AND op = 'insert'",
+                             [(rid,) for rid, _ in entries])
+
+    def outbox_retry_later(self, ids, delay, error):
+        with self._write_lock:
+            self._conn().executemany(
+                "UPDATE mirror_outbox SET attempts = attempts + 1, next_try_at = ?, last_error = ?"
+                " WHERE reservation_id = ?", [(time.time() + delay, error, i) for i in ids])
+
+    def outbox_next_due(self):
+        """次の送信時刻までの秒数（送信待ちがなければ None）"""
+        (due,) = self._conn().execute("SELECT MIN(next_try_at) FROM mirror_outbox").fetchone()
+        return None if due is None else max(0.0, due - time.time())
+
+    def outbox_status(self):
+        """(送信待ち件数, 最古の待ち時間[秒], 直近のエラー)"""
+        count, oldest = self._conn().execute("SELECT COUNT(*), MIN(queued_at) FROM mirror_outbox").fetchone()
+        err = self._conn().execute(
+            "SELECT last_error FROM mirror_outbox WHERE last_error != '' ORDER BY next_try_at DESC LIMIT 1"
+        ).fetchone()
+        return count, (time.time() - oldest) if oldest else 0.0, err[0] if err else ""
+
+    def legacy_sheet_rows(self):
+        """ID 列導入前に記録したミラーの行番号: {行番号: id}"""
+        return dict(self._conn().execute(
+            "SELECT sheet_row, id FROM reservations WHERE sheet_row IS NOT NULL").fetchall())
+
+    def meta(self, key):
+        rec = self._conn().execute("SELECT value FROM meta WHERE key = ?", (key,)).fetchone()
+        return rec[0] if rec else None
+
+    def set_meta(self, key, value):
+        with self._write_lock:
+            self._conn().execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, value))
+
+    def is_empty(self):
+        return self._conn().execute("SELECT 1 FROM reservations LIMIT 1").fetchone() is None
+
+
+class MirroredStorage(ReservationStorage):
+    """主ストアに書いたうえで、ミラー（Google Sheets 等）へ別スレッドで後書きする。
+
+    変更は主ストアと同じトランザクションで送信待ち（mirror_outbox）に積まれるため、
+    画面はローカル保存の完了だけを待てばよく、プロセスが落ちても再起動後に送られる。
+    送信スレッドは最初にミラーへつないで bootstrap() を行い（失敗時は指数バックオフで再試行）、
+    その後、溜まった変更を insert／cancel ごとに1回の呼び出しへまとめて送る。
+    送信の失敗も指数バックオフで再試行する。ミラーの行は主ストアと同じ id で特定する。
+    archive_after_days を指定すると、同じスレッドで1日1回ミラーの古い行を
+    アーカイブへ移す（ミラーが archive() を持つ場合）。
+
+    主ストアが空のまま起動したときは、bootstrap() でミラーの既存データを取り込むまで
+    予約の読み書きを RuntimeError で断る（空の主ストアで受け付けた予約と、後から
+    取り込む id が重ならないように）。
+    """
+    FLUSH_INTERVAL = 2.0    # 変更をまとめるための待ち時間（秒）
+    MAX_BACKOFF = 300.0
+    ARCHIVE_INTERVAL = 24 * 3600.0
+
+    def __init__(self, primary, mirror, archive_after_days=None):
+        self.primary = primary
+        self.mirror = mirror
+        self.archive_after_days = archive_after_days
+        self._next_archive = time.time() + 60   # 起動直後の読込と重ならないよう少し待つ
+        self._wakeup = threading.Event()
+        self._bootstrap_error = ""
+        self._ready = threading.Event()
+        if not primary.is_empty():
+            self._ready.set()
+        threading.Thread(target=self._sync_loop, name="storage-mirror", daemon=True).start()
+
+    def bootstrap(self):
+        """起動時にミラーと主ストアの id をそろえる（初回移行用）。取り込んだ件数を返す
+
+        主ストアが空なら、ミラーの予約シートとアーカイブシート（あれば）を全件読んで取り込む。
+        ID 列のある行はその id のまま、ID 列が空の行と、先の行と同じ ID を持つ別の予約の行
+        （手で複写した行など）には、どのシートの ID よりも後の id を振る。振った id は先に
+        ミラーの ID 列へ書き込んでから取り込むので、途中で失敗しても次の試行でそろう。
+        同じ ID で中身も同じ行（追記の再送・アーカイブの途中失敗による重複）は1件として取り込み、ログに残す。
+        主ストアが空でなければ ID 列だけを読み、ID 列導入前に記録した行番号のうち、
+        まだその id が入っていないものへ id を書き込む。
+        済んだことは主ストアの meta（'mirror_ids'）に記録し、以後の起動ではミラーを読まない。
+        """
+        if self.primary.meta("mirror_ids"):
+            self._ready.set()
+            return 0
+        imported = 0
+        if self.primary.is_empty():
+            rows = self.mirror.load_range()
+            if hasattr(self.mirror, "load_archived"):
+                rows += self.mirror.load_archived()
+            kept, renumber = {}, []
+            for r in rows:
+                first = kept.get(r["id"]) if r["id"] is not None else None
+                if r["id"] is None:
+                    renumber.append(r)
+                elif first is None:
+                    kept[r["id"]] = r
+                elif all(first[k] == r[k] for k in BOOKING_KEYS):
+                    log.warning("ミラーの %s %d 行目は %s %d 行目と同じ予約（ID %d）の重複なので1件として取り込みます",
+                                r.get("sheet") or "予約シート", r["sheet_row"],
+                                first.get("sheet") or "予約シート", first["sheet_row"], r["id"])
+                    if r["status"] == "cancel":
+                        kept[r["id"]] = {**first, "status": "cancel", "cancel": r["cancel"]}
+                else:
+                    renumber.append(r)
+            renumber = [{**r, "id": max(kept, default=0) + 1 + i} for i, r in enumerate(renumber)]
+            by_sheet = {}
+            for r in renumber:
+                by_sheet.setdefault(r.get("sheet"), {})[r["sheet_row"]] = r["id"]
+            for sheet, mapping in by_sheet.items():
+                self.mirror.assign_ids(mapping, sheet=sheet)
+            self.primary.insert_many(list(kept.values()) + renumber)
+            imported = len(kept) + len(renumber)
+        else:
+            legacy = self.primary.legacy_sheet_rows()
+            if legacy:
+                self.mirror.assign_ids(self.mirror.stale_id_rows(legacy))
+        self.primary.set_meta("mirror_ids", 1)
+        self._ready.set()
+        return imported
+
+    def ready(self):
+        """主ストアを読み書きしてよいか（ミラーからの初回取込が済んでいるか）"""
+        return self._ready.is_set()
+
+    def _check_ready(self):
+        if not self._ready.is_set():
+            raise RuntimeError("Google Sheets からの初回取込が済んでいません。しばらくしてから再読込してください。"
+                               + (f"（{self._bootstrap_error}）" if self._bootstrap_error else ""))
+
+    def load_range(self, start=None, end=None):
+        self._check_ready()
+        return self.primary.load_range(start, end)
+
+    def iter_range(self, start=None, end=None):
+        self._check_ready()
+        return self.primary.iter_range(start, end)
+
+    def list_by_date(self, date):
+        self._check_ready()
+        return self.primary.list_by_date(date)
+
+    def revision(self):
+        return self.primary.revision()
+
+    def load_changes(self, since):
+        self._check_ready()
+        return self.primary.load_changes(since)
+
+    def usage_totals(self):
+        return self.primary.usage_totals()
+
+    def insert(self, row):
+        return self.insert_many([row])[0]
+
+    def insert_many(self, rows):
+        self._check_ready()
+        ids = self.primary.insert_many(rows, enqueue=True)
+        self._wakeup.set()
+        return ids
+
+    def insert_checked(self, rows, conflicts):
+        self._check_ready()
+        ids, rejected = self.primary.insert_checked(rows, conflicts, enqueue=True)
+        if ids:
+            self._wakeup.set()
+        return ids, rejected
+
+    def cancel(self, ids, cancel_date):
+        self._check_ready()
+        done = self.primary.cancel(ids, cancel_date, enqueue=True)
+        if done:
+            self._wakeup.set()
+        return done
+
+    def sync_status(self):
+        """(送信待ち件数, 最古の待ち時間[秒], 直近のエラー)"""
+        count, age, error = self.primary.outbox_status()
+        return count, age, self._bootstrap_error or error
+
+    def _bootstrap_with_retry(self):
+        """bootstrap() が通るまで指数バックオフで繰り返す（送信スレッドの最初に呼ぶ）"""
+        delay = self.FLUSH_INTERVAL
+        while True:
+            try:
+                imported = self.bootstrap()
+                if imported:
+                    log.info("ミラーから %d 件を取り込みました", imported)
+                self._bootstrap_error = ""
+                return
+            except Exception as e:
+                self._bootstrap_error = f"ミラーに接続できません: {e}"
+                log.warning("ミラーの初期読込に失敗しました（%.0f秒後に再試行）: %s", delay, e)
+                time.sleep(delay)
+                delay = min(self.MAX_BACKOFF, delay * 2)
+
+    def _sync_loop(self):
+        # 取込・ID の付与が済むまでは送らない（書込みは送信待ちに溜まる）
+        self._bootstrap_with_retry()
+        while True:
+            wait = self.primary.outbox_next_due()
+            self._wakeup.wait(timeout=60 if wait is None else wait)
+            self._wakeup.clear()
+            time.sleep(self.FLUSH_INTERVAL)
+            try:
+                while self.flush():
+                    pass
+                if self.archive_after_days and time.time() >= self._next_archive:
+                    self._next_archive = time.time() + self.ARCHIVE_INTERVAL
+                    self.archive()
+            except Exception:
+                log.exception("ミラー送信スレッドでエラーが発生しました")
+
+    def archive(self):
+        """ミラーの古い行・取消済みの行をアーカイブへ移す
+
+        送信待ちの取消が移した行を指していると反映できないので、送信待ちが残っている間は
+        何もしない（翌日に回す）。
+        送信スレッドからだけ呼ぶこと。移した件数を返す。
+        """
+        if not hasattr(self.mirror, "archive") or self.primary.outbox_status()[0]:
+            return 0
+        cutoff = _date.today() - timedelta(days=self.archive_after_days)
+        moved = self.mirror.archive(str(cutoff))
+        if moved:
+            log.info("ミラーの %d 行をアーカイブへ移しました（%s より前・取消済み）", moved, cutoff)
+        return moved
+
+    def flush(self):
+        """送信時刻に達した変更を1バッチ送る。送ったものがあれば True"""
+        due = self.primary.outbox_due()
+        if not due:
+            return False
+        attempts = {rid: n for rid, _, n, _ in due}
+        versions = {rid: v for rid, _, _, v in due}
+        rows = {r["id"]: r for r in self.primary.get(attempts)}
+        inserts = [rows[rid] for rid, op, _, _ in due if op == "insert" and rid in rows]
+        cancels = [rows[rid] for rid, op, _, _ in due if op == "cancel" and rid in rows]
+        done = [rid for rid in attempts if rid not in rows]  # 主ストアから消えたもの
+        for batch, send in ((inserts, self._send_inserts), (cancels, self._send_cancels)):
+            if not batch:
+                continue
+            ids = [r["id"] for r in batch]
+            try:
+                send(batch)
+                done += ids
+            except Exception as e:
+                delay = min(self.MAX_BACKOFF, 2.0 ** (max(attempts[i] for i in ids) + 1))
+                log.warning("ミラーへの反映に失敗しました（%d件、%.0f秒後に再試行）: %s", len(ids), delay, e)
+                self.primary.outbox_retry_later(ids, delay, str(e))
+        self.primary.outbox_done([(rid, versions[rid]) for rid in done])
+        return bool(done)
+
+    def _send_inserts(self, rows):
+        # 行には主ストアの id が入っているので、ミラーにも同じ id で書かれる
+        self.mirror.insert_many(rows)
+
+    def _send_cancels(self, rows):
+        self.mirror.cancel_many([(r["id"], r["cancel"]) for r in rows])
@@ -0,0 +1,72 @@
+# =========================================================
+# model.py のテスト（スナップショットの差分反映・自分の書込みの反映）
+# =========================================================
+
+from model import Reservation, ReservationSnapshot, RoomLayout, to_minutes
+
+LAYOUT = RoomLayout()   # 既定の 前側／奥側／全面
+DATE = "2030-01-01"
+
+
+def record(rid, room="前側", start="09:00", end="10:00", status="active", date=DATE):
+    return Reservation.from_row({"id": rid, "room": room, "date": date, "start": start, "end": end,
+                                 "user": "u", "purpose": "", "ext": "", "status": status, "cancel": ""}, LAYOUT)
+
+
+def snapshot(*records):
+    day = record(0).day
+    return ReservationSnapshot(1, {r.id: r for r in records}, window=(day - 7, day + 7))
+
+
+def ids_on(snap, day):
+    return sorted(r.id for r in snap.on_date(day))
+
+
+def indexed(snap, day):
+    return sorted(r.id for _, _, r in snap.index.get(day, ((), ()))[1])
+
+
+def test_own_write_after_delta_poll_is_not_duplicated():
+    snap = snapshot(record(1))
+    new = record(2, start="11:00", end="12:00")
+    # 差分の読込が先に自分の書込みを拾い、その後で自分の書込みを反映する
+    snap = snap.with_changes(2, [new], revision=5).with_added(3, [new])
+    day = new.day
+    assert ids_on(snap, day) == [1, 2]
+    assert indexed(snap, day) == [1, 2]
+
+
+def test_cancel_after_duplicate_leaves_no_ghost():
+    new = record(2)
+    snap = snapshot().with_added(2, [new]).with_changes(3, [new], revision=5)
+    snap = snap.with_cancelled(4, [new._replace(status="cancel")])
+    assert indexed(snap, new.day) == []
+    assert not snap.conflicts(LAYOUT.masks["全面"], new.day, to_minutes("09:00"), to_minutes("10:00"))
+
+
+def test_cancel_twice_is_idempotent():
+    r = record(1)
+    cancelled = r._replace(status="cancel", cancel="2029-12-01")
+    snap = snapshot(r).with_cancelled(2, [cancelled]).with_cancelled(3, [cancelled])
+    assert [x.status for x in snap.on_date(r.day)] == ["cancel"]
+    assert snap.by_id[1].status == "cancel"
+
+
+def test_with_changes_moves_record_and_skips_days_outside_window():
+    r = record(1)
+    moved = r._replace(day=r.day + 1)
+    far = record(2, date="2031-01-01")
+    snap = snapshot(r).with_changes(2, [moved, far], revision=7)
+    assert ids_on(snap, r.day) == []
+    assert ids_on(snap, r.day + 1) == [1]
+    assert 2 not in snap.by_id
+    assert snap.revision == 7
+
+
+def test_updates_do_not_touch_the_previous_snapshot():
+    r = record(1)
+    before = snapshot(r)
+    after = before.with_cancelled(2, [r._replace(status="cancel")])
+    assert before.conflicts(LAYOUT.masks["前側"], r.day, to_minutes("09:30"), to_minutes("09:45"))
+    assert not after.conflicts(LAYOUT.masks["前側"], r.day, to_minutes("09:30"), to_minutes("09:45"))
+    assert [x.status for x in before.on_date(r.day)] == ["active"]
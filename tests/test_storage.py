@@ -0,0 +1,201 @@
+# =========================================================
+# storage.py のテスト（SQLite 主ストア・ミラーへの初回取込）
+# =========================================================
+
+import threading
+from functools import partial
+
+import pytest
+
+from model import RoomLayout, row_conflicts, to_minutes
+from sheets import SHEET_HEADER, FakeWorksheet, GSheetStorage, LocalSheetPool
+from storage import MirroredStorage, SQLiteStorage
+
+LAYOUT = RoomLayout()   # 既定の 前側／奥側／全面
+
+
+def booking(room, date, hour, user="u"):
+    return {"room": room, "date": date, "start": f"{hour:02d}:00", "end": f"{hour + 1:02d}:00", "user": user}
+
+
+def overlaps(rows):
+    """部屋・時間が重なる有効な行の組の数"""
+    active = [r for r in rows if r["status"] == "active"]
+    count = 0
+    for i, a in enumerate(active):
+        for b in active[i + 1:]:
+            if (a["date"] == b["date"] and LAYOUT.masks[a["room"]] & LAYOUT.masks[b["room"]]
+                    and to_minutes(a["start"]) < to_minutes(b["end"])
+                    and to_minutes(b["start"]) < to_minutes(a["end"])):
+                count += 1
+    return count
+
+
+class OfflineMirror(MirroredStorage):
+    """送信スレッドを動かさない MirroredStorage（bootstrap を直接呼ぶ）"""
+
+    def _sync_loop(self):
+        pass
+
+
+def test_insert_checked_has_no_overlaps_under_concurrency(tmp_path):
+    path = str(tmp_path / "race.db")
+    SQLiteStorage(path)
+    dates = ["2030-01-01", "2030-01-02"]
+    conflicts = partial(row_conflicts, layout=LAYOUT)
+    accepted = []
+
+    def work(seed):
+        # スレッドごとに別の接続（別インスタンス）から書く：プロセス間の競合と同じ条件
+        storage = SQLiteStorage(path)
+        for i in range(60):
+            row = booking(LAYOUT.rooms[(seed + i) % len(LAYOUT.rooms)], dates[i % 2], 9 + (seed * 7 + i) % 11)
+            ids, _ = storage.insert_checked([row], conflicts)
+            accepted.extend(ids)
+
+    threads = [threading.Thread(target=work, args=(n,)) for n in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    rows = SQLiteStorage(path).load_range()
+    assert len(rows) == len(accepted) > 0
+    assert overlaps(rows) == 0
+
+
+def test_insert_checked_rejects_overlap_within_one_call(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "a.db"))
+    ids, rejected = storage.insert_checked(
+        [booking("前側", "2030-01-01", 9), booking("全面", "2030-01-01", 9), booking("奥側", "2030-01-01", 9)],
+        partial(row_conflicts, layout=LAYOUT))
+    assert len(ids) == 2
+    assert [r["room"] for r in rejected] == ["全面"]
+
+
+def test_cancel_twice_is_a_no_op(tmp_path):
+    storage = SQLiteStorage(str(tmp_path / "a.db"))
+    ids = storage.insert_many([booking("前側", "2030-01-01", 9)])
+    assert storage.cancel(ids, "2029-12-01") == ids
+    revision = storage.revision()
+
+    assert storage.cancel(ids + [999], "2029-12-15") == []
+    assert storage.revision() == revision
+    assert storage.get(ids)[0]["cancel"] == "2029-12-01"
+    assert storage.usage_totals()[1] == [("2030-01", "前側", 1, 1)]
+
+
+def test_mirrored_cancel_queues_only_real_cancels(tmp_path):
+    mirror = GSheetStorage(LocalSheetPool(FakeWorksheet([SHEET_HEADER])))
+    storage = OfflineMirror(SQLiteStorage(str(tmp_path / "a.db")), mirror)
+    storage.bootstrap()
+    ids = storage.insert_many([booking("前側", "2030-01-01", 9)])
+    storage.primary.outbox_done([(ids[0], 0)])
+    assert storage.sync_status()[0] == 0
+    storage.cancel(ids, "2029-12-01")
+    assert storage.sync_status()[0] == 1
+    storage.primary.outbox_done([(ids[0], 0)])
+    assert storage.cancel(ids, "2029-12-02") == []
+    assert storage.sync_status()[0] == 0
+
+
+def sheet_row(date, rid):
+    return ["前側", date, "09:00", "10:00", "u", "", "", "active", "", rid]
+
+
+def test_bootstrap_numbers_blank_ids_after_sheet_ids(tmp_path):
+    sheet = FakeWorksheet([SHEET_HEADER, sheet_row("2030-01-01", ""), sheet_row("2030-01-02", 1),
+                           sheet_row("2030-01-03", 2), sheet_row("2030-01-04", "")])
+    storage = OfflineMirror(SQLiteStorage(str(tmp_path / "a.db")), GSheetStorage(LocalSheetPool(sheet)))
+    assert not storage.ready()
+
+    assert storage.bootstrap() == 4
+    assert storage.ready()
+    assert {r["date"]: r["id"] for r in storage.load_range()} == {
+        "2030-01-01": 3, "2030-01-02": 1, "2030-01-03": 2, "2030-01-04": 4}
+    assert [int(row[-1]) for row in sheet.values[1:]] == [3, 1, 2, 4]
+
+
+def test_bootstrap_refuses_access_until_imported(tmp_path):
+    sheet = FakeWorksheet([SHEET_HEADER, sheet_row("2030-01-01", 1)])
+    storage = OfflineMirror(SQLiteStorage(str(tmp_path / "a.db")), GSheetStorage(LocalSheetPool(sheet)))
+    with pytest.raises(RuntimeError):
+        storage.load_range()
+    with pytest.raises(RuntimeError):
+        storage.insert_many([booking("奥側", "2030-01-01", 9)])
+    assert storage.primary.is_empty()
+
+
+def test_bootstrap_reads_sheet_only_once(tmp_path):
+    sheet = FakeWorksheet([SHEET_HEADER, sheet_row("2030-01-01", 1)])
+    path = str(tmp_path / "a.db")
+    OfflineMirror(SQLiteStorage(path), GSheetStorage(LocalSheetPool(sheet))).bootstrap()
+    calls = sheet.call_count
+
+    restarted = OfflineMirror(SQLiteStorage(path), GSheetStorage(LocalSheetPool(sheet)))
+    assert restarted.ready()
+    assert restarted.bootstrap() == 0
+    assert sheet.call_count == calls
+
+
+def test_bootstrap_merges_resent_rows_and_renumbers_copied_rows(tmp_path):
+    copied = sheet_row("2030-01-05", 1)
+    copied[4] = "別の担当者"
+    resent = sheet_row("2030-01-01", 1)
+    resent[7:9] = ["cancel", "2029-12-01"]   # 再送で二重になった行の片方だけが取り消されている
+    sheet = FakeWorksheet([SHEET_HEADER, sheet_row("2030-01-01", 1), resent, copied, sheet_row("2030-01-02", 2)])
+    storage = OfflineMirror(SQLiteStorage(str(tmp_path / "a.db")), GSheetStorage(LocalSheetPool(sheet)))
+
+    assert storage.bootstrap() == 3
+    rows = {r["id"]: r for r in storage.load_range()}
+    assert sorted(rows) == [1, 2, 3]
+    assert (rows[1]["date"], rows[1]["status"]) == ("2030-01-01", "cancel")
+    assert (rows[3]["date"], rows[3]["user"]) == ("2030-01-05", "別の担当者")
+    assert [int(row[-1]) for row in sheet.values[1:]] == [1, 1, 3, 2]
+
+
+def test_append_is_not_duplicated_when_resent_after_a_lost_response():
+    sheet = FakeWorksheet([SHEET_HEADER])
+    mirror = GSheetStorage(LocalSheetPool(sheet))
+    append_rows = sheet.append_rows
+
+    def written_then_timeout(values, **kwargs):
+        append_rows(values, **kwargs)
+        raise OSError("timed out")
+
+    sheet.append_rows = written_then_timeout
+    with pytest.raises(OSError):
+        mirror.insert_many([{**booking("前側", "2030-01-01", 9), "id": 7}])
+    sheet.append_rows = append_rows
+
+    assert mirror.insert_many([{**booking("前側", "2030-01-01", 9), "id": 7},
+                               {**booking("奥側", "2030-01-01", 9), "id": 8}]) == [7, 8]
+    assert [row[-1] for row in sheet.values[1:]] == [7, 8]
+
+
+def test_cancel_finds_rows_after_the_sheet_is_reordered():
+    sheet = FakeWorksheet([SHEET_HEADER])
+    mirror = GSheetStorage(LocalSheetPool(sheet))
+    mirror.insert_many([{**booking("前側", "2030-01-01", 9), "id": 1}, {**booking("奥側", "2030-01-02", 9), "id": 2}])
+    sheet.values[1:] = reversed(sheet.values[1:])   # 誰かがシートを並べ替えた
+    sheet.values.insert(1, sheet_row("2030-01-03", 3))
+
+    assert mirror.cancel_many([(1, "2029-12-01")]) == []
+    assert {int(row[-1]): row[7] for row in sheet.values[1:]} == {3: "active", 2: "active", 1: "cancel"}
+
+
+def test_bootstrap_restores_archived_rows(tmp_path):
+    sheet = FakeWorksheet([SHEET_HEADER, sheet_row("2030-01-01", 9), sheet_row("2030-02-01", 2),
+                           sheet_row("2030-02-02", "")])
+    pool = LocalSheetPool(sheet)
+    assert GSheetStorage(pool).archive("2030-01-15") == 1   # 最大の ID 9 はアーカイブシートへ移る
+    archived = pool.worksheet("archive_2030-01")
+    archived.values.append(sheet_row("2030-01-02", ""))
+
+    # reservations.db を失って作り直した
+    rebuilt = OfflineMirror(SQLiteStorage(str(tmp_path / "new.db")), GSheetStorage(pool))
+    assert rebuilt.bootstrap() == 4
+    assert {r["date"]: r["id"] for r in rebuilt.load_range()} == {
+        "2030-01-01": 9, "2030-01-02": 11, "2030-02-01": 2, "2030-02-02": 10}
+    assert [int(row[-1]) for row in archived.values[1:]] == [9, 11]
+    assert [int(row[-1]) for row in sheet.values[1:3]] == [2, 10]
@@ -0,0 +1,130 @@
+# =========================================================
+# 予約データの取込・書出（CSV / iCalendar）
+# - read_csv   : CSV を1行ずつ読み、保存行（FIELDS のキー）にして返す
+#                旧形式の《全面》（前側・奥側の2行、担当者に(全面)付き）は1行に畳む
+# - csv_chunks : 保存行 → CSV（シートと同じ 区画/日付/開始/終了/…/ID の列）
+# - ics_chunks : 保存行 → iCalendar（.ics）
+# いずれもジェネレータで、全件を DataFrame 等にまとめずに流す。
+# Streamlit には依存しない
+# =========================================================
+
+import csv
+import io
+from datetime import datetime, timezone
+
+from sheets import ID_COLUMN, SHEET_HEADER, SHEET_KEYS
+
+FULL_MARK = "(全面)"
+STATUS_ALIASES = {"": "active", "有効": "active", "active": "active", "取消": "cancel", "cancel": "cancel"}
+
+
+def _normalize_date(value):
+    """"2025-10-01" / "2025/10/1" → "2025-10-01"（読めなければそのまま返し、検証側で弾く）"""
+    value = value.strip()
+    for fmt in ("%Y-%m-%d", "%Y/%m/%d"):
+        try:
+            return datetime.strptime(value, fmt).date().isoformat()
+        except ValueError:
+            pass
+    return value
+
+
+def read_csv(stream):
+    """CSV（1行目がヘッダ）を読み、(行番号, 保存行) を順に返す
+
+    ヘッダに足りない列があれば ValueError（ID 列は任意で、取込では常に新しい id を振るので読まない。
+    既存と同じ予約の行は、取込側の検証（main.validate_import）で除く）。
+    状態は 有効/取消 の表記も受け付ける。
+    担当者に (全面) が付いた前側・奥側の行は、相方（同じ日付・時間・担当者・状態）が
+    揃った時点で区画=全面の1行にして返す。相方のない行はファイル末尾でそのまま返す。
+    """
+    reader = csv.DictReader(stream)
+    columns = [k for k in SHEET_HEADER if k != ID_COLUMN]
+    missing = [k for k in columns if k not in (reader.fieldnames or [])]
+    if missing:
+        raise ValueError(f"列が足りません: {'、'.join(missing)}")
+    halves = {}
+    for rec in reader:
+        row = {SHEET_KEYS[k]: (rec.get(k) or "").strip() for k in columns}
+        row["date"] = _normalize_date(row["date"])
+        row["status"] = STATUS_ALIASES.get(row["status"], row["status"])
+        line = reader.line_num
+        if row["room"] in ("前側", "奥側") and row["user"].endswith(FULL_MARK):
+            row["user"] = row["user"][:-len(FULL_MARK)]
+            key = (row["date"], row["start"], row["end"], row["user"], row["status"])
+            other = halves.pop(key, None)
+            if other is None or other[1]["room"] == row["room"]:
+                if other is not None:
+                    yield other
+                halves[key] = (line, row)
+            else:
+                yield other[0], {**other[1], "room": "全面"}
+            continue
+        yield line, row
+    yield from halves.values()
+
+
+def csv_chunks(rows):
+    """保存行 → CSV テキストを1行ずつ（先頭はヘッダ）"""
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\r\n")
+    writer.writerow(SHEET_HEADER)
+    yield buf.getvalue()
+    for row in rows:
+        buf.seek(0)
+        buf.truncate()
+        writer.writerow([row[SHEET_KEYS[k]] for k in SHEET_HEADER])
+        yield buf.getvalue()
+
+
+def _ics_text(value):
+    return (str(value).replace("\\", "\\\\").replace(";", "\\;").replace(",", "\\,")
+            .replace("\r\n", "\\n").replace("\n", "\\n"))
+
+
+def _ics_line(line):
+    """RFC 5545 の折り返し（75オクテットごとに改行＋空白）"""
+    data = line.encode("utf-8")
+    if len(data) <= 75:
+        return line + "\r\n"
+    out, chunk = [], b""
+    for ch in line:
+        enc = ch.encode("utf-8")
+        if len(chunk) + len(enc) > (75 if not out else 74):
+            out.append(chunk.decode("utf-8"))
+            chunk = b""
+        chunk += enc
+    out.append(chunk.decode("utf-8"))
+    return "\r\n ".join(out) + "\r\n"
+
+
+def ics_chunks(rows, name="会議室予約", domain="meeting-room.local"):
+    """保存行 → iCalendar（1予約1 VEVENT、取消は STATUS:CANCELLED）
+
+    時刻はタイムゾーンなし（各自の端末の現地時刻 = 日本時間として扱われる）。
+    """
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%dT%H%M%SZ")
+    yield "".join(_ics_line(line) for line in [
+        "BEGIN:VCALENDAR", "VERSION:2.0", "PRODID:-//meeting-room//reservations//JA",
+        "CALSCALE:GREGORIAN", f"X-WR-CALNAME:{_ics_text(name)}",
+    ])
+    for row in rows:
+        day = row["date"].replace("-", "")
+        start = row["start"].replace(":", "").zfill(4)
+        end = row["end"].replace(":", "").zfill(4)
+        summary = f"{row['room']} {row['user']}".strip()
+        desc = "　".join(v for v in (row["purpose"], f"内線 {row['ext']}" if row["ext"] else "") if v)
+        lines = [
+            "BEGIN:VEVENT",
+            f"UID:{row['id']}@{domain}",
+            f"DTSTAMP:{stamp}",
+            f"DTSTART:{day}T{start}00",
+            f"DTEND:{day}T{end}00",
+            f"SUMMARY:{_ics_text(summary)}",
+            f"LOCATION:{_ics_text('会議室 ' + row['room'])}",
+        ]
+        if desc:
+            lines.append(f"DESCRIPTION:{_ics_text(desc)}")
+        lines += ["STATUS:CANCELLED" if row["status"] == "cancel" else "STATUS:CONFIRMED", "END:VEVENT"]
+        yield "".join(_ics_line(line) for line in lines)
+    yield "END:VCALENDAR\r\n"